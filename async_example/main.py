@@ -1,12 +1,30 @@
+import sys
+from pathlib import Path
+
 from fastapi import FastAPI
 
-app = FastAPI()
+# shared modules (threadpool.py, ...) live at the repo root
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from threadpool import (
+    ThreadpoolGroup,
+    env_capacity,
+    run_in,
+    threadpool_lifespan,
+    threadpool_metrics_router,
+)
+
+# THREADPOOL_SIZE sizes the default threadpool, SYNC_THREADS the threads reserved for /sync
+blocking_threads = ThreadpoolGroup("blocking", env_capacity("SYNC_THREADS", 40))
+
+app = FastAPI(lifespan=threadpool_lifespan(env_capacity("THREADPOOL_SIZE", 40)))
+app.include_router(threadpool_metrics_router(blocking_threads))
 
 # ENDPOINT THAT SLEEPS FOR 1 SECOND
 import time
 
 
 @app.get("/sync")
+@run_in(blocking_threads)
 def read_sync():
     time.sleep(2)
     return {"message": "Synchronous blocking endpoint"}
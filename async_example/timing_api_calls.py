@@ -1,27 +1,220 @@
+# Load generator for the apps in this repo.
+#
+# Starts an app with uvicorn in a separate process, waits until it answers, then drives one or more
+# paths with N concurrent async httpx clients and reports throughput and latency percentiles.
+#
+#   python timing_api_calls.py                      # /sync vs /async of this folder's main:app
+#   python timing_api_calls.py --concurrency 1 10 50 100 --duration 10 --json
+#   python timing_api_calls.py --app-dir ../task_manager_app --path /tasks --requests 2000
+#   python timing_api_calls.py --url http://localhost:8000 --path /tasks   # server already running
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import socket
+import sys
+import time
+from contextlib import contextmanager
+from multiprocessing import Process
+from pathlib import Path
+
+import httpx
 import uvicorn
-from main import app
-from fastapi import time
 
 
-def run_server():
-    uvicorn.run(
-        app, port=8000, log_level="error"
-    )  # starts your fast api app from main.py running uvicorn
+def find_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
 
 
-from contextlib import contextmanager
-from multiprocessing import Process
+def run_server(app: str, app_dir: str, port: int):
+    # the apps import their own modules (from database import ...) and open files relative to their
+    # folder (tasks.csv, test.db), so the server runs from inside it like serve.py does
+    app_dir = str(Path(app_dir).resolve())
+    os.chdir(app_dir)
+    uvicorn.run(app, app_dir=app_dir, port=port, log_level="error")
+
+
+def wait_until_ready(base_url: str, process: Process, ready_path: str, timeout: float):
+    # instead of sleeping a fixed time we poll until the server answers anything at all
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if not process.is_alive():
+            raise RuntimeError(f"Server exited with code {process.exitcode}")
+        try:
+            httpx.get(base_url + ready_path, timeout=1)
+            return
+        except httpx.TransportError:
+            time.sleep(0.05)
+    raise TimeoutError(f"Server at {base_url} not ready after {timeout}s")
 
 
 @contextmanager
-def run_server_in_process():
-    p = Process(
-        target=run_server
-    )  # starts the server in another process(background process)
-    p.start()  # starts the server
-    time.sleep(
-        2
-    )  # give the server a second to start # waits for the server to fully boot before you send requests
-    print("Server is running in a seprate process")
-    yield  # allows you to run other code (like making api calls) while the server is running
-    p.terminate()  # automatically shuts dow the server
+def run_server_in_process(
+    app: str = "main:app",
+    app_dir: str = ".",
+    port: int | None = None,
+    ready_path: str = "/openapi.json",
+    timeout: float = 10,
+):
+    port = port or find_free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    p = Process(target=run_server, args=(app, app_dir, port), daemon=True)
+    p.start()
+    try:
+        wait_until_ready(base_url, p, ready_path, timeout)
+        yield base_url
+    finally:
+        p.terminate()  # shuts the server down, also when the benchmark fails
+        p.join()
+
+
+def percentile(sorted_values: list[float], percent: float) -> float:
+    # nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(percent / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies: list[float], errors: int, elapsed: float) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round((latencies[-1] if latencies else 0.0) * 1000, 2),
+    }
+
+
+async def drive(
+    base_url: str,
+    path: str,
+    concurrency: int,
+    duration: float | None = None,
+    requests: int | None = None,
+) -> dict:
+    # `concurrency` workers share one connection pool and send requests back to back until the
+    # duration is over or `requests` requests were sent. Failed requests (transport errors or 5xx)
+    # are counted as errors and left out of the latency numbers.
+    latencies = []
+    errors = 0
+    remaining = requests
+    limits = httpx.Limits(
+        max_connections=concurrency, max_keepalive_connections=concurrency
+    )
+    async with httpx.AsyncClient(
+        base_url=base_url, limits=limits, timeout=60
+    ) as client:
+        start = time.perf_counter()
+        deadline = start + duration if duration is not None else math.inf
+
+        async def worker():
+            nonlocal errors, remaining
+            while time.perf_counter() < deadline:
+                if remaining is not None:
+                    if remaining <= 0:
+                        return
+                    remaining -= 1
+                sent = time.perf_counter()
+                try:
+                    response = await client.get(path)
+                    failed = response.status_code >= 500
+                except httpx.HTTPError:
+                    failed = True
+                if failed:
+                    errors += 1
+                else:
+                    latencies.append(time.perf_counter() - sent)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return summarize(latencies, errors, elapsed)
+
+
+def print_table(results: list[dict]):
+    columns = [
+        "path",
+        "concurrency",
+        "requests",
+        "errors",
+        "throughput_rps",
+        "p50_ms",
+        "p95_ms",
+        "p99_ms",
+        "max_ms",
+    ]
+    print("  ".join(f"{column:>14}" for column in columns))
+    for result in results:
+        print("  ".join(f"{result[column]!s:>14}" for column in columns))
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark an app of this repo under concurrent load"
+    )
+    parser.add_argument("--app", default="main:app", help="uvicorn import string")
+    parser.add_argument(
+        "--app-dir",
+        default=str(Path(__file__).parent),
+        help="folder the app is loaded from",
+    )
+    parser.add_argument(
+        "--url", help="benchmark an already running server instead of starting one"
+    )
+    parser.add_argument(
+        "--path", action="append", help="path to request, can be given several times"
+    )
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50, 100])
+    limit = parser.add_mutually_exclusive_group()
+    limit.add_argument("--duration", type=float, help="seconds to run each step")
+    limit.add_argument("--requests", type=int, help="requests to send in each step")
+    parser.add_argument("--ready-path", default="/openapi.json")
+    parser.add_argument("--json", action="store_true", help="print the results as json")
+    arguments = parser.parse_args(argv)
+    arguments.path = arguments.path or ["/sync", "/async"]
+    if arguments.duration is None and arguments.requests is None:
+        arguments.duration = 5
+    return arguments
+
+
+def benchmark(base_url: str, arguments) -> list[dict]:
+    results = []
+    for path in arguments.path:
+        for concurrency in arguments.concurrency:
+            result = asyncio.run(
+                drive(
+                    base_url, path, concurrency, arguments.duration, arguments.requests
+                )
+            )
+            results.append({"path": path, "concurrency": concurrency, **result})
+            if not arguments.json:
+                print(f"{path} concurrency={concurrency}: {result}", file=sys.stderr)
+    return results
+
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+    if arguments.url:
+        results = benchmark(arguments.url.rstrip("/"), arguments)
+    else:
+        with run_server_in_process(
+            arguments.app, arguments.app_dir, ready_path=arguments.ready_path
+        ) as base_url:
+            print("Server is running in a separate process", file=sys.stderr)
+            results = benchmark(base_url, arguments)
+    if arguments.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results)
+
+
+if __name__ == "__main__":
+    main()
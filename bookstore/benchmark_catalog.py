@@ -0,0 +1,97 @@
+# Query latency and bulk load time of the book catalog for growing catalog sizes.
+#
+#   python benchmark_catalog.py                      # 10k, 100k and 1M books
+#   python benchmark_catalog.py --sizes 1000000 5000000
+#
+# Every query returns one page of 20 books. With the sorted year index and the author hash index the
+# time per query should stay about the same from the smallest to the biggest catalog.
+# The "+1k" and "+100k" columns add that many books to the full catalog with one add_many, like one
+# batch of POST /books/ndjson does. They grow with the catalog size, but only linearly.
+
+import argparse
+import random
+import time
+
+from catalog import BookCatalog
+from models import Book
+
+AUTHORS = [f"Author {number}" for number in range(2000)]
+
+
+def make_books(count: int) -> list[Book]:
+    return [
+        Book.model_construct(
+            title=f"Book {number}",
+            author=random.choice(AUTHORS),
+            year=random.randint(1901, 2099),
+        )
+        for number in range(count)
+    ]
+
+
+def build_catalog(size: int) -> tuple[BookCatalog, float]:
+    books = make_books(size)
+    catalog = BookCatalog()
+    start = time.perf_counter()
+    catalog.add_many(books)
+    return catalog, time.perf_counter() - start
+
+
+def time_bulk_add(size: int, count: int) -> float:
+    catalog, _ = build_catalog(size)
+    books = make_books(count)
+    start = time.perf_counter()
+    catalog.add_many(books)
+    return time.perf_counter() - start
+
+
+def time_queries(catalog: BookCatalog, make_query, repeat: int) -> float:
+    queries = [make_query() for _ in range(repeat)]
+    start = time.perf_counter()
+    for query in queries:
+        catalog.query(**query, limit=20)
+    return (time.perf_counter() - start) / repeat * 1_000_000  # microseconds per query
+
+
+def random_range() -> dict:
+    year_from = random.randint(1901, 2089)
+    return {"year_from": year_from, "year_to": year_from + 10}
+
+
+QUERIES = {
+    "year range": random_range,
+    "year range, page 50": lambda: {**random_range(), "offset": 1000},
+    "author": lambda: {"author": random.choice(AUTHORS)},
+    "author + year range": lambda: {"author": random.choice(AUTHORS), **random_range()},
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark book catalog queries")
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--repeat", type=int, default=10_000)
+    arguments = parser.parse_args()
+
+    print(
+        f"{'books':>10}  {'load':>8}  {'+1k':>8}  {'+100k':>8}  "
+        + "  ".join(f"{name:>20}" for name in QUERIES)
+    )
+    for size in arguments.sizes:
+        catalog, load_time = build_catalog(size)
+        bulk_times = [time_bulk_add(size, count) for count in (1000, 100_000)]
+        timings = [
+            time_queries(catalog, make_query, arguments.repeat)
+            for make_query in QUERIES.values()
+        ]
+        print(
+            f"{size:>10}  {load_time:>7.2f}s  "
+            + "  ".join(f"{timing * 1000:>6.1f}ms" for timing in bulk_times)
+            + "  "
+            + "  ".join(f"{timing:>18.1f}us" for timing in timings)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import groupby
+from operator import itemgetter
+
+from models import Book
+
+
+class YearIndex:
+    # Sorted index on (year, id), kept as two parallel arrays so bisect can search the years directly.
+    # Ids only grow, so inserting after the last book of the same year keeps the (year, id) order.
+    # The arrays hold machine ints: copying them moves raw memory, without touching a million
+    # int objects and their reference counts.
+    # The arrays are never changed in place. A writer builds new ones and replaces both with a single
+    # assignment of `columns`, so a reader in another thread always sees years and ids that belong
+    # together, without taking a lock.
+
+    def __init__(self):
+        self.columns = (array("q"), array("q"))  # (years, ids)
+
+    def __len__(self):
+        return len(self.columns[1])
+
+    def insert_many(self, pairs: list[tuple[int, int]]):
+        # Merges new (year, id) pairs, all with ids above the ones already here. Instead of one
+        # insert per book (each shifting the rest of the index) the new pairs are sorted, their
+        # positions found by bisect, and the arrays rebuilt once from slices: O(n + k log n), with the
+        # O(n) part being memory copies.
+        old_years, old_ids = self.columns
+        pairs.sort()
+        years = array("q")
+        ids = array("q")
+        previous = 0
+        # new books of the same year all go to the same position, one bisect and copy per year
+        for year, year_pairs in groupby(pairs, key=itemgetter(0)):
+            position = bisect_right(old_years, year, previous)
+            years.extend(old_years[previous:position])
+            ids.extend(old_ids[previous:position])
+            new_ids = [book_id for _, book_id in year_pairs]
+            years.extend(array("q", [year]) * len(new_ids))
+            ids.extend(new_ids)
+            previous = position
+        years.extend(old_years[previous:])
+        ids.extend(old_ids[previous:])
+        self.columns = (years, ids)
+
+    def page(
+        self, year_from: int | None, year_to: int | None, offset: int, limit: int
+    ) -> tuple[int, array]:
+        # O(log n + limit): number of books in [year_from, year_to] and the ids of one page of them
+        years, ids = self.columns
+        start = 0 if year_from is None else bisect_left(years, year_from)
+        end = len(years) if year_to is None else bisect_right(years, year_to)
+        end = max(start, end)
+        return end - start, ids[start + offset : min(end, start + offset + limit)]
+
+
+class BookCatalog:
+    # In-memory catalog: books by id, a hash index from author to that author's books and a sorted
+    # index on year. Every listing is ordered by (year, id) and answered by slicing a sorted index,
+    # so a page costs O(log n + limit) however big the catalog is.
+    # Writers (add, add_many) run in worker threads, one at a time under _write_lock, so a big import
+    # never blocks the event loop. Readers don't lock: a book is stored before its id is put in an
+    # index, and the indexes are swapped in whole (see YearIndex).
+
+    def __init__(self):
+        self._write_lock = threading.Lock()
+        self._books: dict[int, Book] = {}
+        self._next_id = 1
+        self._by_year = YearIndex()
+        self._by_author: dict[str, YearIndex] = {}
+
+    def __len__(self):
+        return len(self._books)
+
+    @staticmethod
+    def author_key(author: str) -> str:
+        return author.casefold()
+
+    def add(self, book: Book) -> int:
+        return self.add_many([book])[0]
+
+    def add_many(self, books: list[Book]) -> list[int]:
+        with self._write_lock:
+            return self._add_many_locked(books)
+
+    def _add_many_locked(self, books: list[Book]) -> list[int]:
+        year_pairs = []
+        author_pairs: dict[str, list[tuple[int, int]]] = {}
+        book_ids = []
+        for book in books:
+            book_id = self._next_id
+            self._next_id += 1
+            self._books[book_id] = book
+            book_ids.append(book_id)
+            year_pairs.append((book.year, book_id))
+            author_pairs.setdefault(self.author_key(book.author), []).append(
+                (book.year, book_id)
+            )
+        # one merge per index instead of one insert per book
+        self._by_year.insert_many(year_pairs)
+        for key, pairs in author_pairs.items():
+            self._by_author.setdefault(key, YearIndex()).insert_many(pairs)
+        return book_ids
+
+    def get(self, book_id: int) -> Book | None:
+        return self._books.get(book_id)
+
+    def query(
+        self,
+        author: str | None = None,
+        year_from: int | None = None,
+        year_to: int | None = None,
+        offset: int = 0,
+        limit: int = 50,
+    ) -> tuple[int, list[tuple[int, Book]]]:
+        # returns the number of matching books and one page of (id, book)
+        if author is not None:
+            index = self._by_author.get(self.author_key(author))
+            if index is None:
+                return 0, []
+        else:
+            index = self._by_year
+        total, page_ids = index.page(year_from, year_to, offset, limit)
+        return total, [(book_id, self._books[book_id]) for book_id in page_ids]
@@ -0,0 +1,21 @@
+TEST_BOOKS = [
+    {"title": "The Great Gatsby", "author": "F. Scott Fitzgerald", "year": 1925},
+    {"title": "1984", "author": "George Orwell", "year": 1949},
+    {"title": "Animal Farm", "author": "George Orwell", "year": 1945},
+    {"title": "Tender Is the Night", "author": "F. Scott Fitzgerald", "year": 1934},
+    {"title": "Brave New World", "author": "Aldous Huxley", "year": 1932},
+]
+
+import pytest
+from unittest.mock import patch
+
+from catalog import BookCatalog
+from models import Book
+
+
+@pytest.fixture(autouse=True)  # every test starts with the same small catalog
+def test_catalog():
+    catalog = BookCatalog()
+    catalog.add_many([Book(**book) for book in TEST_BOOKS])
+    with patch("main.catalog", catalog):
+        yield catalog
@@ -0,0 +1,67 @@
+from pydantic import TypeAdapter, ValidationError
+
+from models import Book
+
+# Built once at import: pydantic compiles the validator for Book here instead of on every request.
+book_adapter = TypeAdapter(Book)
+
+BATCH_LINES = 1000  # lines validated per trip to a worker thread
+MAX_LINE_LENGTH = 64 * 1024
+MAX_REPORTED_ERRORS = (
+    100  # after this rejected lines are only counted, so the report stays small
+)
+
+
+async def iter_line_batches(body_stream):
+    # Splits a streamed body into (line number, line) batches. Only the current batch and the unfinished
+    # end of the last chunk are kept in memory, whatever the size of the body. A line that grows past
+    # MAX_LINE_LENGTH is dropped and handed on as None, so it can be reported as an error.
+    batch = []
+    pending = b""
+    line_number = 0
+    oversized = False
+    async for chunk in body_stream:
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            line_number += 1
+            too_long = oversized or len(line) > MAX_LINE_LENGTH
+            batch.append((line_number, None if too_long else line))
+            oversized = False
+            if len(batch) >= BATCH_LINES:
+                yield batch
+                batch = []
+        if len(pending) > MAX_LINE_LENGTH:
+            pending = b""
+            oversized = True
+    if pending or oversized:
+        too_long = oversized or len(pending) > MAX_LINE_LENGTH
+        batch.append((line_number + 1, None if too_long else pending))
+    if batch:
+        yield batch
+
+
+def compact_errors(exc: ValidationError) -> list[dict]:
+    return [
+        {"loc": ".".join(str(part) for part in error["loc"]), "msg": error["msg"]}
+        for error in exc.errors(include_url=False, include_input=False)
+    ]
+
+
+def validate_batch(batch: list[tuple[int, bytes | None]]):
+    # runs in a worker thread, returns the valid books and the errors of the other lines
+    books = []
+    errors = []
+    for line_number, line in batch:
+        if line is None:
+            errors.append(
+                {"line": line_number, "errors": [{"loc": "", "msg": "Line too long"}]}
+            )
+            continue
+        if not line.strip():
+            continue
+        try:
+            books.append(book_adapter.validate_json(line))
+        except ValidationError as exc:
+            errors.append({"line": line_number, "errors": compact_errors(exc)})
+    return books, errors
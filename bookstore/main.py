@@ -20,12 +20,40 @@ app = FastAPI()
 #         return {"year": year, "books": ["Book1", "Book 2"]}
 #     return {"books": ["All Books"]}
 
-from models import Book
+from fastapi import HTTPException, Query
+from models import Book, BookPage, BookWithId
+from catalog import BookCatalog
+import anyio
 
+catalog = BookCatalog()
 
-@app.post("/book")
+
+@app.post("/book", response_model=BookWithId)
 async def create_book(book: Book):
-    return book
+    # writers may wait for an import batch to be merged, they do that in a worker thread
+    book_id = await anyio.to_thread.run_sync(catalog.add, book)
+    return BookWithId(id=book_id, **book.model_dump())
+
+
+@app.get("/books", response_model=BookPage)
+async def list_books(
+    author: str | None = None,
+    year_from: int | None = None,
+    year_to: int | None = None,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(50, gt=0, le=500),
+):
+    total, page = catalog.query(author, year_from, year_to, offset, limit)
+    items = [BookWithId(id=book_id, **book.model_dump()) for book_id, book in page]
+    return BookPage(total=total, offset=offset, limit=limit, items=items)
+
+
+@app.get("/books/{book_id}", response_model=BookWithId)
+async def read_book(book_id: int):
+    book = catalog.get(book_id)
+    if book is None:
+        raise HTTPException(status_code=404, detail="Book not found")
+    return BookWithId(id=book_id, **book.model_dump())
 
 
 # from pydantic import BaseModel
@@ -76,3 +104,27 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
         "This is a plain text response:" f"\n{json.dumps(exc.errors(),indent=2)}",
         status_code=status.HTTP_400_BAD_REQUEST,
     )
+
+
+from ingest import MAX_REPORTED_ERRORS, iter_line_batches, validate_batch
+
+
+@app.post("/books/ndjson")
+async def ingest_books(request: Request):
+    # Catalog import: one book per line (newline delimited json). Valid lines are added, invalid ones
+    # are reported by line number and skipped, one bad line never aborts the import.
+    accepted = rejected = 0
+    errors = []
+    async for batch in iter_line_batches(request.stream()):
+        books, batch_errors = await anyio.to_thread.run_sync(validate_batch, batch)
+        # merging into a big catalog copies its indexes, that happens off the event loop too
+        await anyio.to_thread.run_sync(catalog.add_many, books)
+        accepted += len(books)
+        rejected += len(batch_errors)
+        errors.extend(batch_errors[: MAX_REPORTED_ERRORS - len(errors)])
+    return {
+        "accepted": accepted,
+        "rejected": rejected,
+        "errors": errors,
+        "errors_truncated": rejected > len(errors),
+    }
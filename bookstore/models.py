@@ -5,3 +5,14 @@ class Book(BaseModel):
     title: str = Field(..., min_length=1, max_length=100)
     author: str = Field(..., min_length=1, max_length=50)
     year: int = Field(..., gt=1900, lt=2100)
+
+
+class BookWithId(Book):
+    id: int
+
+
+class BookPage(BaseModel):
+    total: int  # number of books matching the filters, not just on this page
+    offset: int
+    limit: int
+    items: list[BookWithId]
@@ -0,0 +1,157 @@
+from main import app
+from fastapi.testclient import TestClient
+
+client = TestClient(app)
+
+from conftest import TEST_BOOKS
+
+
+def titles(response) -> list[str]:
+    return [book["title"] for book in response.json()["items"]]
+
+
+def test_endpoint_create_and_read_book():
+    book = {"title": "Dune", "author": "Frank Herbert", "year": 1965}
+    response = client.post("/book", json=book)
+    assert response.status_code == 200
+    created = response.json()
+    assert created == {**book, "id": len(TEST_BOOKS) + 1}
+
+    response = client.get(f"/books/{created['id']}")
+    assert response.json() == created
+    assert client.get("/books/999").status_code == 404
+
+    response = client.post("/book", json={**book, "year": 1800})
+    assert response.status_code == 400
+
+
+def test_endpoint_list_books():
+    response = client.get("/books")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["total"] == len(TEST_BOOKS)
+    # always ordered by year
+    assert [book["year"] for book in body["items"]] == [1925, 1932, 1934, 1945, 1949]
+
+    response = client.get("/books", params={"offset": 1, "limit": 2})
+    assert response.json()["total"] == len(TEST_BOOKS)
+    assert titles(response) == ["Brave New World", "Tender Is the Night"]
+
+
+def test_endpoint_list_books_by_year_range():
+    response = client.get("/books", params={"year_from": 1930, "year_to": 1945})
+    assert response.json()["total"] == 3
+    assert titles(response) == ["Brave New World", "Tender Is the Night", "Animal Farm"]
+
+    response = client.get("/books", params={"year_from": 1950})
+    assert response.json() == {"total": 0, "offset": 0, "limit": 50, "items": []}
+
+
+def test_endpoint_list_books_by_author():
+    response = client.get("/books", params={"author": "george orwell"})
+    assert titles(response) == ["Animal Farm", "1984"]
+
+    response = client.get(
+        "/books", params={"author": "F. Scott Fitzgerald", "year_from": 1930}
+    )
+    assert titles(response) == ["Tender Is the Night"]
+
+    response = client.get("/books", params={"author": "Nobody"})
+    assert response.json()["total"] == 0
+
+
+def test_catalog_keeps_indexes_in_order(test_catalog):
+    from models import Book
+
+    test_catalog.add(
+        Book(title="Homage to Catalonia", author="George Orwell", year=1938)
+    )
+    total, page = test_catalog.query(author="George Orwell")
+    assert [book.year for _, book in page] == [1938, 1945, 1949]
+    total, page = test_catalog.query(year_from=1938, year_to=1938)
+    assert total == 1
+
+
+import json
+from unittest.mock import patch
+
+
+def test_endpoint_ingest_books(test_catalog):
+    lines = [
+        json.dumps({"title": "Dune", "author": "Frank Herbert", "year": 1965}),
+        json.dumps({"title": "", "author": "Nobody", "year": 1800}),
+        "",
+        "not json",
+        json.dumps({"title": "Neuromancer", "author": "William Gibson", "year": 1984}),
+    ]
+    body = "\n".join(lines).encode()
+
+    def chunked_body():  # split in the middle of lines on purpose
+        for start in range(0, len(body), 7):
+            yield body[start : start + 7]
+
+    with patch("ingest.BATCH_LINES", 2):
+        response = client.post("/books/ndjson", content=chunked_body())
+    assert response.status_code == 200
+    report = response.json()
+    assert report["accepted"] == 2
+    assert report["rejected"] == 2
+    assert [error["line"] for error in report["errors"]] == [2, 4]
+    assert {error["loc"] for error in report["errors"][0]["errors"]} == {
+        "title",
+        "year",
+    }
+    assert report["errors_truncated"] is False
+
+    response = client.get("/books", params={"author": "William Gibson"})
+    assert titles(response) == ["Neuromancer"]
+    assert len(test_catalog) == len(TEST_BOOKS) + 2
+
+
+def test_endpoint_ingest_books_limits():
+    lines = ["{}"] * 5 + ["x" * 100] + [json.dumps(TEST_BOOKS[0])]
+    with patch("main.MAX_REPORTED_ERRORS", 3), patch("ingest.MAX_LINE_LENGTH", 90):
+        response = client.post("/books/ndjson", content="\n".join(lines) + "\n")
+    report = response.json()
+    assert (report["accepted"], report["rejected"]) == (1, 6)
+    assert len(report["errors"]) == 3
+    assert report["errors_truncated"] is True
+
+    with patch("ingest.MAX_LINE_LENGTH", 50):
+        response = client.post("/books/ndjson", content="x" * 100)
+    assert response.json()["errors"][0]["errors"][0]["msg"] == "Line too long"
+
+
+import asyncio
+
+
+def test_endpoint_ingest_books_merges_off_the_event_loop(test_catalog):
+    on_event_loop = []
+    add_many = test_catalog.add_many
+
+    def recording_add_many(books):
+        try:
+            asyncio.get_running_loop()
+            on_event_loop.append(True)
+        except RuntimeError:  # no loop running in this thread
+            on_event_loop.append(False)
+        return add_many(books)
+
+    lines = [
+        json.dumps(
+            {"title": f"Book {number}", "author": "Author", "year": 2000 - number}
+        )
+        for number in range(10)
+    ]
+    with patch.object(test_catalog, "add_many", recording_add_many), patch(
+        "ingest.BATCH_LINES", 3
+    ):
+        response = client.post("/books/ndjson", content="\n".join(lines))
+    assert response.json()["accepted"] == 10
+    assert on_event_loop == [False] * 4
+
+    total, page = test_catalog.query(author="author", limit=100)
+    assert total == 10
+    assert [book.year for _, book in page] == list(range(1991, 2001))
+    total, page = test_catalog.query(year_from=1949, limit=100)
+    assert [book.year for _, book in page] == [1949] + list(range(1991, 2001))
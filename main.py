@@ -1,10 +1,18 @@
 from fastapi import FastAPI
 import router_example
+from response_cache import ResponseCache
 
 app = FastAPI()
 app.include_router(router_example.router)
 
+root_cache = ResponseCache(ttl=60)
 
-@app.get("/")
+
+@root_cache.cached_get(app, "/")
 async def read_root():
     return {"message": "Hello World"}
+
+
+@app.get("/cache/stats")
+async def read_cache_stats():
+    return {"root": root_cache.stats(), "items": router_example.items_cache.stats()}
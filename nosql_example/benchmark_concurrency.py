@@ -0,0 +1,107 @@
+# Benchmark for the mongo executor, no mongo server needed.
+#
+# The users collection is replaced with an in-memory mongomock collection where every query sleeps
+# for --latency seconds, like a slow query on a real server would. While a burst of slow user lookups
+# is in flight we keep calling a plain sync `def` endpoint that runs on fastapi's shared threadpool and
+# measure how long it takes to answer.
+#
+#   python benchmark_concurrency.py --requests 200 --latency 0.2
+#
+# With mode "threadpool" the mongo calls run on the shared threadpool like the old sync handlers did,
+# with mode "executor" they go through database.db_executor.
+
+import argparse
+import asyncio
+import statistics
+import time
+from unittest.mock import patch
+
+import httpx
+import mongomock
+from starlette.concurrency import run_in_threadpool
+
+import database
+import main
+
+
+class SlowCollection:
+    def __init__(self, collection, latency: float):
+        self._collection = collection
+        self._latency = latency
+
+    def find_one(self, *args, **kwargs):
+        time.sleep(self._latency)
+        return self._collection.find_one(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+
+def probe():
+    return {"ok": True}
+
+
+main.app.add_api_route("/probe", probe)
+
+
+async def run_on_threadpool(function, *args, **kwargs):
+    return await run_in_threadpool(function, *args, **kwargs)
+
+
+async def run_scenario(mode: str, collection, requests: int, probes: int) -> dict:
+    user_id = str(
+        collection.insert_one(
+            {"name": "Bench", "email": "bench@example.com"}
+        ).inserted_id
+    )
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+
+        async def timed_probe():
+            start = time.perf_counter()
+            await client.get("/probe")
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        lookups = [
+            asyncio.create_task(client.get("/user", params={"user_id": user_id}))
+            for _ in range(requests)
+        ]
+        await asyncio.sleep(0.05)  # let the burst reach the threads first
+        probe_latencies = [await timed_probe() for _ in range(probes)]
+        responses = await asyncio.gather(*lookups)
+        assert all(response.status_code == 200 for response in responses)
+        elapsed = time.perf_counter() - start
+    return {
+        "mode": mode,
+        "elapsed": elapsed,
+        "probe_p50": statistics.median(probe_latencies),
+        "probe_max": max(probe_latencies),
+    }
+
+
+async def run(requests: int, latency: float, probes: int):
+    for mode in ("threadpool", "executor"):
+        collection = SlowCollection(
+            mongomock.MongoClient().mydatabase["users"], latency
+        )
+        run_db = run_on_threadpool if mode == "threadpool" else database.run_db
+        with patch("main.user_collection", collection), patch("main.run_db", run_db):
+            result = await run_scenario(mode, collection, requests, probes)
+        print(
+            f"{result['mode']:>10}: {requests} slow lookups in {result['elapsed']:.2f}s, "
+            f"probe p50 {result['probe_p50'] * 1000:.1f}ms max {result['probe_max'] * 1000:.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare mongo on the shared threadpool against the mongo executor"
+    )
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--probes", type=int, default=5)
+    arguments = parser.parse_args()
+    asyncio.run(run(arguments.requests, arguments.latency, arguments.probes))
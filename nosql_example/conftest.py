@@ -0,0 +1,50 @@
+TEST_USERS = [
+    {"name": "Test User One", "email": "one@example.com"},
+    {"name": "Test User Two", "email": "two@example.com"},
+    {"name": "Test User Three", "email": "three@example.com"},
+]
+
+import mongomock
+import pytest
+from unittest.mock import patch
+from pymongo.results import BulkWriteResult
+from indexes import ensure_indexes
+
+
+def fake_bulk_write(collection):
+    # mongomock's bulk_write does not work with recent pymongo versions, so the UpdateOne
+    # operations used by the bulk endpoint are applied one by one instead
+    def bulk_write(requests, ordered=True):
+        upserted = []
+        matched = 0
+        for index, request in enumerate(requests):
+            result = collection.update_one(
+                request._filter, request._doc, upsert=request._upsert
+            )
+            if result.upserted_id is not None:
+                upserted.append({"index": index, "_id": result.upserted_id})
+            matched += result.matched_count
+        return BulkWriteResult(
+            {
+                "writeErrors": [],
+                "nMatched": matched,
+                "nUpserted": len(upserted),
+                "upserted": upserted,
+            },
+            acknowledged=True,
+        )
+
+    return bulk_write
+
+
+@pytest.fixture(
+    autouse=True
+)  # every test gets a fresh in-memory collection, no mongo server is needed
+def fake_user_collection():
+    database = mongomock.MongoClient().mydatabase
+    ensure_indexes(database)
+    collection = database["users"]
+    collection.insert_many([dict(user) for user in TEST_USERS])
+    collection.bulk_write = fake_bulk_write(collection)
+    with patch("main.user_collection", collection):
+        yield collection
@@ -1,6 +1,74 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
 from pymongo import MongoClient
 
-client = MongoClient()
+from monitoring import QueryMonitor
+
+# All the connection settings can be tuned with environment variables, the defaults are pymongo's own
+# except for the timeouts, which are shorter so a dead server fails a request fast instead of hanging it.
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "30000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(
+    os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")
+)
+
+# number of threads that are allowed to talk to mongo at the same time.
+# it never makes sense to have more threads than pooled connections, the extra ones would just wait for a socket.
+MONGO_EXECUTOR_WORKERS = int(
+    os.getenv("MONGO_EXECUTOR_WORKERS", str(min(32, MONGO_MAX_POOL_SIZE)))
+)
+
+# documents sent per insert_many / bulk_write call by the bulk endpoint. The server accepts at most
+# 100000 writes or 48MB per batch, a smaller chunk keeps each round trip (and each error report) small.
+MONGO_BULK_CHUNK_SIZE = int(os.getenv("MONGO_BULK_CHUNK_SIZE", "1000"))
+
+# queries slower than this are logged and listed on /debug/queries
+MONGO_SLOW_QUERY_MS = float(os.getenv("MONGO_SLOW_QUERY_MS", "100"))
+# explain the first query of every shape and report the ones that scan the whole collection
+MONGO_EXPLAIN_QUERIES = os.getenv("MONGO_EXPLAIN_QUERIES", "true").lower() == "true"
+
+query_monitor = QueryMonitor(
+    slow_query_ms=MONGO_SLOW_QUERY_MS, explain_queries=MONGO_EXPLAIN_QUERIES
+)
+
+client = MongoClient(  # MongoClient does not connect here, the first query opens the connections
+    MONGO_URI,
+    maxPoolSize=MONGO_MAX_POOL_SIZE,
+    minPoolSize=MONGO_MIN_POOL_SIZE,
+    maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+    waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+    socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+    serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    event_listeners=[query_monitor],
+)
 database = client.mydatabase
 
 user_collection = database["users"]
+
+# pymongo is a blocking driver. Instead of running it on fastapi's shared threadpool (40 threads for the
+# whole app) every query goes through this executor, so slow mongo queries can only use up these threads
+# and the rest of the app keeps working.
+db_executor = ThreadPoolExecutor(
+    max_workers=MONGO_EXECUTOR_WORKERS, thread_name_prefix="mongo"
+)
+# the monitor explains new query shapes with this client, on these threads
+query_monitor.attach(client, db_executor)
+
+
+async def run_db(function, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, partial(function, *args, **kwargs))
+
+
+def close_database():
+    db_executor.shutdown(wait=True)
+    client.close()
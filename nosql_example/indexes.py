@@ -0,0 +1,21 @@
+from pymongo import ASCENDING, IndexModel
+
+# Every index the app relies on is declared here, per collection, and created at startup by ensure_indexes.
+# create_indexes does nothing for indexes that already exist with the same definition,
+# so it is safe to run on every start. Add new query patterns here together with their index.
+INDEXES = {
+    "users": [
+        # email identifies a user: bulk upserts and email lookups use it, and it must be unique
+        IndexModel([("email", ASCENDING)], unique=True, name="email_unique"),
+        IndexModel([("name", ASCENDING)], name="name"),
+    ],
+}
+
+
+def ensure_indexes(database, indexes: dict[str, list[IndexModel]] = INDEXES) -> dict:
+    created = {}
+    for collection_name, index_models in indexes.items():
+        created[collection_name] = database[collection_name].create_indexes(
+            index_models
+        )
+    return created
@@ -1,9 +1,36 @@
-from database import user_collection
-from fastapi import FastAPI, HTTPException
+import json
+from collections import Counter
+from contextlib import asynccontextmanager
+from itertools import islice
+from typing import Literal
+
+from database import (
+    MONGO_BULK_CHUNK_SIZE,
+    close_database,
+    database,
+    query_monitor,
+    run_db,
+    user_collection,
+)
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from indexes import ensure_indexes
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await run_db(
+        ensure_indexes, database
+    )  # fails the startup if e.g. duplicate emails exist
+    yield
+    close_database()  # waits for running queries, then closes the connection pool
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
 
 
 class User(BaseModel):
@@ -11,9 +38,82 @@ class User(BaseModel):
     email: str
 
 
+USER_FIELDS = set(User.model_fields)
+
+
+def build_users_query(after: str | None, fields: str | None):
+    # cursor based pagination: we only ask for documents with an _id bigger than the last one the client saw.
+    # _id always has an index so this stays fast no matter how deep the client pages (unlike skip()).
+    query = {}
+    if after is not None:
+        if not ObjectId.is_valid(after):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query["_id"] = {"$gt": ObjectId(after)}
+    # projection: only the requested fields travel over the wire, _id is always returned
+    projection = None
+    if fields:
+        requested = {field.strip() for field in fields.split(",") if field.strip()}
+        unknown = requested - USER_FIELDS
+        if unknown:
+            raise HTTPException(
+                status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}"
+            )
+        projection = {field: 1 for field in requested}
+    return query, projection
+
+
+def serialize_user(document: dict) -> dict:
+    # turn the ObjectId into a string so the document can be sent as json
+    return {"id": str(document.pop("_id")), **document}
+
+
+def fetch_batch(cursor, size: int) -> list[dict]:
+    # runs in the db executor, pulls at most `size` documents out of an open cursor
+    return list(islice(cursor, size))
+
+
 @app.get("/users")
-def read_users() -> list[User]:
-    return [user for user in user_collection.find()]
+async def read_users(
+    after: str | None = None,
+    limit: int = Query(100, gt=0, le=1000),
+    fields: str | None = None,
+    batch_size: int = Query(100, gt=0, le=1000),
+    stream: bool = False,
+):
+    query, projection = build_users_query(after, fields)
+    cursor = user_collection.find(query, projection).sort("_id", 1)
+    # batch_size controls how many documents the driver fetches per round trip to the server
+    cursor = cursor.batch_size(batch_size)
+
+    if stream:
+        # ndjson: one json document per line, written as soon as the cursor yields it,
+        # so the whole collection never has to sit in memory (limit is not applied here)
+        async def generate_users():
+            # one trip to the db executor per batch instead of per document
+            try:
+                while batch := await run_db(fetch_batch, cursor, batch_size):
+                    yield "".join(
+                        json.dumps(serialize_user(document)) + "\n"
+                        for document in batch
+                    )
+            finally:
+                # also runs when the client disconnects, so the server side cursor is not left open
+                await run_db(cursor.close)
+
+        return StreamingResponse(generate_users(), media_type="application/x-ndjson")
+
+    documents = await run_db(list, cursor.limit(limit))
+    users = [serialize_user(document) for document in documents]
+    headers = {}
+    if len(users) == limit:
+        # the id of the last user is the cursor for the next page
+        headers["X-Next-Cursor"] = users[-1]["id"]
+    return JSONResponse(users, headers=headers)
+
+
+@app.get("/debug/queries")
+async def read_query_stats():
+    return query_monitor.report()
 
 
 class UserResponse(User):
@@ -21,18 +121,137 @@ class UserResponse(User):
 
 
 @app.post("/user")
-def create_user(user: User) -> UserResponse:
-    result = user_collection.insert_one(user.model_dump(exclude_none=True))
+async def create_user(user: User) -> UserResponse:
+    result = await run_db(
+        user_collection.insert_one, user.model_dump(exclude_none=True)
+    )
     user_response = UserResponse(id=str(result.inserted_id), **user.model_dump())
     return user_response
 
 
 @app.get("/user")
-def get_user(user_id: str):
-    db_user = user_collection.find_one(
-        {"_id": ObjectId(user_id) if ObjectId.is_valid(user_id) else None}
+async def get_user(user_id: str):
+    db_user = await run_db(
+        user_collection.find_one,
+        {"_id": ObjectId(user_id) if ObjectId.is_valid(user_id) else None},
     )
     if db_user is None:
         raise HTTPException(status_code=404, detail="User Not Found")
     user_response = UserResponse(id=str(db_user["_id"]), **db_user)
     return user_response
+
+
+class BulkUserResult(BaseModel):
+    index: int  # position of the user in the request body
+    status: Literal["inserted", "updated", "failed"]
+    id: str | None = None
+    error: str | None = None
+
+
+class BulkUsersResponse(BaseModel):
+    inserted: int
+    updated: int
+    failed: int
+    results: list[BulkUserResult]
+
+
+def write_errors_by_index(details: dict) -> dict[int, str]:
+    return {error["index"]: error["errmsg"] for error in details.get("writeErrors", [])}
+
+
+def insert_users_chunk(users: list[User]) -> list[BulkUserResult]:
+    documents = [user.model_dump(exclude_none=True) for user in users]
+    try:
+        # ordered=False: one bad document does not stop the rest of the chunk
+        user_collection.insert_many(documents, ordered=False)
+        errors = {}
+    except BulkWriteError as exc:
+        errors = write_errors_by_index(exc.details)
+    # insert_many sets _id on every document before sending them
+    return [
+        (
+            BulkUserResult(index=index, status="failed", error=errors[index])
+            if index in errors
+            else BulkUserResult(index=index, status="inserted", id=str(document["_id"]))
+        )
+        for index, document in enumerate(documents)
+    ]
+
+
+def upsert_users_chunk(users: list[User]) -> list[BulkUserResult]:
+    operations = [
+        UpdateOne({"email": user.email}, {"$set": user.model_dump()}, upsert=True)
+        for user in users
+    ]
+    try:
+        details = user_collection.bulk_write(operations, ordered=False).bulk_api_result
+    except BulkWriteError as exc:
+        details = exc.details
+    errors = write_errors_by_index(details)
+    inserted_ids = {
+        upserted["index"]: str(upserted["_id"]) for upserted in details["upserted"]
+    }
+    # users that already existed were updated in place, the server does not send their ids back
+    updated_emails = [
+        user.email
+        for index, user in enumerate(users)
+        if index not in inserted_ids and index not in errors
+    ]
+    ids_by_email = {}
+    if updated_emails:
+        existing = user_collection.find(
+            {"email": {"$in": updated_emails}}, {"email": 1}
+        )
+        ids_by_email = {
+            document["email"]: str(document["_id"]) for document in existing
+        }
+
+    results = []
+    for index, user in enumerate(users):
+        if index in errors:
+            result = BulkUserResult(index=index, status="failed", error=errors[index])
+        elif index in inserted_ids:
+            result = BulkUserResult(
+                index=index, status="inserted", id=inserted_ids[index]
+            )
+        else:
+            result = BulkUserResult(
+                index=index, status="updated", id=ids_by_email.get(user.email)
+            )
+        results.append(result)
+    return results
+
+
+@app.post("/users/bulk")
+async def create_users_bulk(
+    users: list[User], upsert: bool = True
+) -> BulkUsersResponse:
+    results: list[BulkUserResult | None] = [None] * len(users)
+    pending = list(enumerate(users))
+    if upsert:
+        # two upserts for the same email in one unordered batch could both insert, the last one wins
+        last_index = {user.email: index for index, user in pending}
+        for index, user in pending:
+            if last_index[user.email] != index:
+                results[index] = BulkUserResult(
+                    index=index,
+                    status="failed",
+                    error=f"Duplicate email, superseded by user {last_index[user.email]}",
+                )
+        pending = [(index, user) for index, user in pending if results[index] is None]
+
+    write_chunk = upsert_users_chunk if upsert else insert_users_chunk
+    for start in range(0, len(pending), MONGO_BULK_CHUNK_SIZE):
+        chunk = pending[start : start + MONGO_BULK_CHUNK_SIZE]
+        # one round trip to mongo per chunk (plus one lookup for the ids of updated users)
+        chunk_results = await run_db(write_chunk, [user for _, user in chunk])
+        for (index, _), result in zip(chunk, chunk_results):
+            results[index] = result.model_copy(update={"index": index})
+
+    counts = Counter(result.status for result in results)
+    return BulkUsersResponse(
+        inserted=counts["inserted"],
+        updated=counts["updated"],
+        failed=counts["failed"],
+        results=results,
+    )
@@ -0,0 +1,164 @@
+import logging
+import threading
+from collections import deque
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# commands that read or write documents matching a filter, those are the ones an index can help
+FILTER_COMMANDS = {
+    "find": "filter",
+    "count": "query",
+    "distinct": "query",
+    "delete": None,
+    "update": None,
+    "findAndModify": "query",
+    "aggregate": None,
+}
+
+
+def query_shape(value):
+    # {"email": "a@b.com", "age": {"$gt": 3}} -> {"age": {"$gt": 1}, "email": 1}
+    # queries that differ only in their values have the same shape and use the same plan
+    if isinstance(value, dict):
+        return {key: query_shape(value[key]) for key in sorted(value)}
+    if isinstance(value, list):
+        # {"$in": [a, b]} and {"$in": [a, b, c]} use the same plan: a list has the shape of its
+        # first item, otherwise every list length would be a new shape (and a new explain)
+        return [query_shape(value[0])] if value else []
+    return 1
+
+
+def find_collscans(plan: dict) -> list[str]:
+    # walks an explain() winning plan and returns the namespaces of every collection scan in it
+    collscans = []
+    if plan.get("stage") == "COLLSCAN":
+        collscans.append(plan.get("namespace", ""))
+    for key in ("queryPlan", "inputStage"):
+        if key in plan:
+            collscans.extend(find_collscans(plan[key]))
+    for stage in plan.get("inputStages", []):
+        collscans.extend(find_collscans(stage))
+    return collscans
+
+
+# Records the duration of every command pymongo sends and keeps the slow ones.
+# It is registered on the MongoClient with event_listeners=[...]. When explain_queries is on, the first
+# find of every query shape is explained in the background and logged if it scans the whole collection.
+class QueryMonitor(monitoring.CommandListener):
+    def __init__(
+        self, slow_query_ms: float = 100, explain_queries: bool = True, keep: int = 100
+    ):
+        self.slow_query_ms = slow_query_ms
+        self.explain_queries = explain_queries
+        self.slow_queries = deque(maxlen=keep)
+        self.collscans = deque(maxlen=keep)
+        self.stats = {}
+        self._pending = {}
+        self._explained_shapes = set()
+        self._lock = threading.Lock()
+        self._client = None
+        self._executor = None
+
+    def attach(self, client, executor):
+        # explain commands are sent with this client on this executor, never on the thread of the query
+        self._client = client
+        self._executor = executor
+
+    def started(self, event):
+        if event.command_name not in FILTER_COMMANDS:
+            return
+        filter_key = FILTER_COMMANDS[event.command_name]
+        query = event.command.get(filter_key, {}) if filter_key else {}
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = (
+                event.database_name,
+                event.command.get(event.command_name),
+                query,
+            )
+
+    def succeeded(self, event):
+        self.record(event, failed=False)
+
+    def failed(self, event):
+        self.record(event, failed=True)
+
+    def record(self, event, failed: bool):
+        duration_ms = event.duration_micros / 1000
+        with self._lock:
+            pending = self._pending.pop((event.connection_id, event.request_id), None)
+            stats = self.stats.setdefault(
+                event.command_name,
+                {"count": 0, "failed": 0, "total_ms": 0.0, "max_ms": 0.0},
+            )
+            stats["count"] += 1
+            stats["failed"] += failed
+            stats["total_ms"] += duration_ms
+            stats["max_ms"] = max(stats["max_ms"], duration_ms)
+        if pending is None:
+            return
+        database_name, collection_name, query = pending
+        if duration_ms >= self.slow_query_ms:
+            slow_query = {
+                "command": event.command_name,
+                "namespace": f"{database_name}.{collection_name}",
+                "shape": query_shape(query),
+                "duration_ms": round(duration_ms, 3),
+            }
+            self.slow_queries.append(slow_query)
+            logger.warning("Slow mongo query: %s", slow_query)
+        if event.command_name == "find" and not failed:
+            self.maybe_explain(database_name, collection_name, query)
+
+    def maybe_explain(self, database_name: str, collection_name: str, query: dict):
+        if not self.explain_queries or self._client is None:
+            return
+        shape = repr((database_name, collection_name, query_shape(query)))
+        with self._lock:
+            if shape in self._explained_shapes:
+                return
+            self._explained_shapes.add(shape)
+        try:
+            self._executor.submit(self.explain, database_name, collection_name, query)
+        except RuntimeError:  # the executor is shutting down
+            pass
+
+    def explain(self, database_name: str, collection_name: str, query: dict):
+        try:
+            explanation = self._client[database_name].command(
+                "explain",
+                {"find": collection_name, "filter": query},
+                verbosity="queryPlanner",
+            )
+        except Exception:
+            logger.exception(
+                "Could not explain query on %s.%s", database_name, collection_name
+            )
+            return
+        winning_plan = explanation.get("queryPlanner", {}).get("winningPlan", {})
+        if find_collscans(winning_plan):
+            collscan = {
+                "namespace": f"{database_name}.{collection_name}",
+                "shape": query_shape(query),
+            }
+            self.collscans.append(collscan)
+            logger.warning("Mongo query without index (COLLSCAN): %s", collscan)
+
+    def report(self) -> dict:
+        with self._lock:
+            commands = {
+                name: {
+                    "count": stats["count"],
+                    "failed": stats["failed"],
+                    "avg_ms": round(stats["total_ms"] / stats["count"], 3),
+                    "max_ms": round(stats["max_ms"], 3),
+                }
+                for name, stats in self.stats.items()
+            }
+        return {
+            "slow_query_ms": self.slow_query_ms,
+            "commands": commands,
+            "slow_queries": list(self.slow_queries),
+            "collscans": list(self.collscans),
+        }
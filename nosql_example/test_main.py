@@ -0,0 +1,258 @@
+import json
+
+from main import app
+from fastapi.testclient import TestClient
+
+client = TestClient(app)
+
+from conftest import TEST_USERS
+
+
+def test_endpoint_read_users():
+    response = client.get("/users")
+    assert response.status_code == 200
+    users = response.json()
+    assert [{"name": u["name"], "email": u["email"]} for u in users] == TEST_USERS
+    assert all("id" in user for user in users)
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_endpoint_read_users_pagination():
+    response = client.get("/users", params={"limit": 2})
+    assert response.status_code == 200
+    first_page = response.json()
+    assert len(first_page) == 2
+    cursor = response.headers["X-Next-Cursor"]
+    assert cursor == first_page[-1]["id"]
+
+    response = client.get("/users", params={"limit": 2, "after": cursor})
+    second_page = response.json()
+    assert [user["email"] for user in second_page] == [TEST_USERS[2]["email"]]
+    assert "X-Next-Cursor" not in response.headers
+
+    response = client.get("/users", params={"after": "not-an-id"})
+    assert response.status_code == 400
+
+
+def test_endpoint_read_users_projection():
+    response = client.get("/users", params={"fields": "email"})
+    assert response.status_code == 200
+    for user, expected in zip(response.json(), TEST_USERS):
+        assert user.keys() == {"id", "email"}
+        assert user["email"] == expected["email"]
+
+    response = client.get("/users", params={"fields": "password"})
+    assert response.status_code == 400
+
+
+def test_endpoint_read_users_stream():
+    response = client.get("/users", params={"stream": True, "batch_size": 1})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["email"] for line in lines] == [user["email"] for user in TEST_USERS]
+
+
+def test_endpoint_create_and_get_user():
+    user = {"name": "New User", "email": "new@example.com"}
+    response = client.post("/user", json=user)
+    assert response.status_code == 200
+    created = response.json()
+    assert created["email"] == user["email"]
+
+    response = client.get("/user", params={"user_id": created["id"]})
+    assert response.status_code == 200
+    assert response.json() == created
+
+    response = client.get("/user", params={"user_id": "missing"})
+    assert response.status_code == 404
+
+
+from unittest.mock import patch
+
+
+def test_endpoint_bulk_upsert_users(fake_user_collection):
+    users = [
+        {"name": "Renamed User One", "email": "one@example.com"},
+        {"name": "Bulk User", "email": "bulk@example.com"},
+        {"name": "Another Bulk User", "email": "another@example.com"},
+        {"name": "Bulk User Again", "email": "bulk@example.com"},
+    ]
+    with patch("main.MONGO_BULK_CHUNK_SIZE", 2):
+        response = client.post("/users/bulk", json=users)
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["inserted"], body["updated"], body["failed"]) == (2, 1, 1)
+    statuses = [result["status"] for result in body["results"]]
+    assert statuses == ["updated", "failed", "inserted", "inserted"]
+
+    existing = fake_user_collection.find_one({"email": "one@example.com"})
+    assert body["results"][0]["id"] == str(existing["_id"])
+    assert existing["name"] == "Renamed User One"
+    assert fake_user_collection.count_documents({"email": "bulk@example.com"}) == 1
+    assert (
+        fake_user_collection.find_one({"email": "bulk@example.com"})["name"]
+        == "Bulk User Again"
+    )
+
+
+def test_endpoint_bulk_insert_users(fake_user_collection):
+    users = [
+        {"name": f"User {number}", "email": f"{number}@example.com"}
+        for number in range(5)
+    ]
+    with patch("main.MONGO_BULK_CHUNK_SIZE", 2):
+        response = client.post("/users/bulk", params={"upsert": False}, json=users)
+    assert response.status_code == 200
+    body = response.json()
+    assert body["inserted"] == 5
+    assert [result["index"] for result in body["results"]] == list(range(5))
+    assert fake_user_collection.count_documents({}) == len(TEST_USERS) + 5
+
+
+def test_endpoint_bulk_insert_reports_duplicate_emails():
+    users = [
+        {"name": "Duplicate", "email": "one@example.com"},
+        {"name": "Fresh", "email": "fresh@example.com"},
+    ]
+    response = client.post("/users/bulk", params={"upsert": False}, json=users)
+    body = response.json()
+    assert (body["inserted"], body["failed"]) == (1, 1)
+    assert body["results"][0]["status"] == "failed"
+    assert body["results"][0]["error"]
+
+
+from types import SimpleNamespace
+
+from monitoring import QueryMonitor, find_collscans, query_shape
+
+
+def command_events(command_name, command, duration_ms, request_id=1):
+    started = SimpleNamespace(
+        command_name=command_name,
+        command={command_name: "users", **command},
+        database_name="mydatabase",
+        connection_id=("localhost", 27017),
+        request_id=request_id,
+    )
+    succeeded = SimpleNamespace(
+        command_name=command_name,
+        connection_id=("localhost", 27017),
+        request_id=request_id,
+        duration_micros=int(duration_ms * 1000),
+    )
+    return started, succeeded
+
+
+def test_query_monitor_records_slow_queries():
+    monitor = QueryMonitor(slow_query_ms=50)
+    for request_id, duration_ms in enumerate([10, 80]):
+        started, succeeded = command_events(
+            "find", {"filter": {"email": "one@example.com"}}, duration_ms, request_id
+        )
+        monitor.started(started)
+        monitor.succeeded(succeeded)
+
+    report = monitor.report()
+    assert report["commands"]["find"]["count"] == 2
+    assert report["commands"]["find"]["max_ms"] == 80
+    assert report["slow_queries"] == [
+        {
+            "command": "find",
+            "namespace": "mydatabase.users",
+            "shape": {"email": 1},
+            "duration_ms": 80,
+        }
+    ]
+
+
+def test_query_shape_and_collscan_detection():
+    assert query_shape({"name": "x", "_id": {"$gt": "y"}}) == {
+        "_id": {"$gt": 1},
+        "name": 1,
+    }
+    plan = {
+        "stage": "FETCH",
+        "inputStage": {
+            "stage": "OR",
+            "inputStages": [
+                {"stage": "IXSCAN", "indexName": "email_unique"},
+                {"stage": "COLLSCAN", "namespace": "mydatabase.users"},
+            ],
+        },
+    }
+    assert find_collscans(plan) == ["mydatabase.users"]
+    assert find_collscans({"stage": "IDHACK"}) == []
+
+
+def test_endpoint_debug_queries():
+    response = client.get("/debug/queries")
+    assert response.status_code == 200
+    assert {"commands", "slow_queries", "collscans"} <= response.json().keys()
+
+
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import database
+
+
+def test_query_monitor_is_attached():
+    assert database.query_monitor._client is database.client
+    assert database.query_monitor._executor is database.db_executor
+
+
+class FakeExplainClient:
+    # answers every explain with a plan that scans the whole collection
+    def __init__(self):
+        self.explained = []
+
+    def __getitem__(self, database_name):
+        return self
+
+    def command(self, name, command, verbosity):
+        self.explained.append(command)
+        return {
+            "queryPlanner": {
+                "winningPlan": {"stage": "COLLSCAN", "namespace": "mydatabase.users"}
+            }
+        }
+
+
+def test_endpoint_debug_queries_lists_collscans():
+    monitor = QueryMonitor(slow_query_ms=1000)
+    fake_client = FakeExplainClient()
+    executor = ThreadPoolExecutor(max_workers=1)
+    monitor.attach(fake_client, executor)
+    for request_id, name in enumerate(["x", "y"]):  # same shape, explained once
+        started, succeeded = command_events(
+            "find", {"filter": {"name": name}}, 1, request_id
+        )
+        monitor.started(started)
+        monitor.succeeded(succeeded)
+    executor.shutdown(wait=True)
+
+    assert fake_client.explained == [{"find": "users", "filter": {"name": "x"}}]
+    with patch("main.query_monitor", monitor):
+        response = client.get("/debug/queries")
+    assert response.json()["collscans"] == [
+        {"namespace": "mydatabase.users", "shape": {"name": 1}}
+    ]
+
+
+def test_in_queries_of_any_length_are_explained_once():
+    assert query_shape({"email": {"$in": ["a", "b"]}}) == query_shape(
+        {"email": {"$in": ["a", "b", "c"]}}
+    )
+    monitor = QueryMonitor(slow_query_ms=1000)
+    fake_client = FakeExplainClient()
+    executor = ThreadPoolExecutor(max_workers=1)
+    monitor.attach(fake_client, executor)
+    for request_id, emails in enumerate([["a", "b"], ["a", "b", "c"]]):
+        started, succeeded = command_events(
+            "find", {"filter": {"email": {"$in": emails}}}, 1, request_id
+        )
+        monitor.started(started)
+        monitor.succeeded(succeeded)
+    executor.shutdown(wait=True)
+    assert len(fake_client.explained) == 1
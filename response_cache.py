@@ -0,0 +1,236 @@
+# Response cache for deterministic GET routes, shared by the apps in this repo.
+#
+#   items_cache = ResponseCache(ttl=30, stale_ttl=300, vary_query=["q"])
+#   router = APIRouter(route_class=items_cache.route_class())      # every route of the router
+#
+#   @items_cache.cached_get(app, "/")                              # or a single route
+#   async def read_root(): ...
+#
+# Entries are keyed on method, path, the selected query parameters and the selected request headers
+# (sent back in the Vary header). The cache is LRU with a limit on entries and on bytes. Fresh entries
+# are served for `ttl` seconds. For `stale_ttl` seconds after that the old response is still served
+# while one background call refreshes it. When several requests miss the same key at once only
+# the first one runs the endpoint, the others wait for its response.
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from contextlib import AsyncExitStack
+
+from fastapi import Request, Response
+from fastapi.routing import APIRoute
+
+logger = logging.getLogger(__name__)
+
+
+class CachedResponse:
+    __slots__ = ("body", "status_code", "raw_headers", "stored_at", "size")
+
+    def __init__(self, response: Response):
+        self.body = response.body
+        self.status_code = response.status_code
+        self.raw_headers = list(response.raw_headers)
+        self.stored_at = time.monotonic()
+        self.size = len(self.body) + sum(
+            len(name) + len(value) for name, value in self.raw_headers
+        )
+
+    def to_response(self, cache_status: str) -> Response:
+        response = Response(status_code=self.status_code)
+        response.body = self.body
+        response.raw_headers = [
+            *self.raw_headers,
+            (b"x-cache", cache_status.encode()),
+            (b"age", str(int(time.monotonic() - self.stored_at)).encode()),
+        ]
+        return response
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        ttl: float = 60,
+        stale_ttl: float = 0,
+        max_entries: int = 1024,
+        max_bytes: int = 16 * 1024 * 1024,
+        vary_query: (
+            list[str] | None
+        ) = None,  # None: every query parameter is part of the key
+        vary_headers: list[str] = (),
+    ):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.vary_query = vary_query
+        self.vary_headers = [header.lower() for header in vary_headers]
+        self._entries: OrderedDict[tuple, CachedResponse] = OrderedDict()
+        self._bytes = 0
+        self._inflight: dict[tuple, asyncio.Future] = {}
+        self._refreshing: set[tuple] = set()
+        # the event loop only keeps weak references to tasks, a refresh nobody references could be
+        # garbage collected halfway and its key would stay in _refreshing for good
+        self._refresh_tasks: set[asyncio.Task] = set()
+        self.hits = self.stale_hits = self.misses = self.coalesced = self.evictions = 0
+
+    def key(self, request: Request) -> tuple:
+        if self.vary_query is None:
+            query = tuple(sorted(request.query_params.multi_items()))
+        else:
+            query = tuple(
+                (name, tuple(request.query_params.getlist(name)))
+                for name in self.vary_query
+            )
+        headers = tuple(request.headers.get(name) for name in self.vary_headers)
+        return request.method, request.url.path, query, headers
+
+    def cacheable(self, response: Response) -> bool:
+        cache_control = response.headers.get("cache-control", "")
+        return (
+            response.status_code == 200
+            and isinstance(
+                getattr(response, "body", None), bytes
+            )  # not a streaming response
+            and "set-cookie" not in response.headers
+            and "no-store" not in cache_control
+            and "private" not in cache_control
+        )
+
+    def store(self, key: tuple, response: Response) -> CachedResponse | None:
+        if not self.cacheable(response):
+            return None
+        if self.vary_headers:
+            response.headers["vary"] = ", ".join(self.vary_headers)
+        entry = CachedResponse(response)
+        if entry.size > self.max_bytes:
+            return None
+        self.discard(key)
+        self._entries[key] = entry
+        self._bytes += entry.size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)  # least recently used
+            self._bytes -= evicted.size
+            self.evictions += 1
+        return entry
+
+    def discard(self, key: tuple):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    async def serve(self, request: Request, handler) -> Response:
+        key = self.key(request)
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = time.monotonic() - entry.stored_at
+            if age <= self.ttl:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry.to_response("HIT")
+            if age <= self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                self._entries.move_to_end(key)
+                if key not in self._refreshing:
+                    self._refreshing.add(key)
+                    task = asyncio.create_task(self.refresh(key, request, handler))
+                    self._refresh_tasks.add(task)
+                    task.add_done_callback(self._refresh_tasks.discard)
+                return entry.to_response("STALE")
+            self.discard(key)
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            # somebody is already computing this response, wait for it instead of computing it again
+            self.coalesced += 1
+            entry = await asyncio.shield(inflight)
+            if entry is not None:
+                return entry.to_response("HIT")
+            return await handler(
+                request
+            )  # the response could not be cached, compute our own
+
+        self.misses += 1
+        inflight = asyncio.get_running_loop().create_future()
+        self._inflight[key] = inflight
+        entry = None
+        try:
+            response = await handler(request)
+            entry = self.store(key, response)
+        finally:
+            del self._inflight[key]
+            inflight.set_result(entry)
+        if entry is not None:
+            response.raw_headers.append((b"x-cache", b"MISS"))
+        return response
+
+    async def refresh(self, key: tuple, request: Request, handler):
+        # runs after the original request is finished, so the endpoint gets a copy of the request with
+        # its own exit stacks for dependencies with yield
+        scope = dict(request.scope)
+        try:
+            async with AsyncExitStack() as stack:
+                for name in scope:
+                    if name.startswith("fastapi_") and name.endswith("astack"):
+                        scope[name] = stack
+                response = await handler(Request(scope, request.receive))
+            self.store(key, response)
+        except Exception:
+            logger.exception("Refreshing cached response for %s failed", key[1])
+        finally:
+            self._refreshing.discard(key)
+
+    def route_class(self) -> type[APIRoute]:
+        cache = self
+
+        class CachedRoute(APIRoute):
+            def get_route_handler(self):
+                handler = super().get_route_handler()
+
+                async def cached_handler(request: Request) -> Response:
+                    if request.method not in ("GET", "HEAD"):
+                        return await handler(request)
+                    return await cache.serve(request, handler)
+
+                return cached_handler
+
+        return CachedRoute
+
+    def cached_get(self, router, path: str, **kwargs):
+        # decorator like @router.get(path), for caching a single route of an app or router
+        router = getattr(
+            router, "router", router
+        )  # a FastAPI app keeps its routes in app.router
+
+        def decorator(endpoint):
+            router.add_api_route(
+                path,
+                endpoint,
+                methods=["GET"],
+                route_class_override=self.route_class(),
+                **kwargs,
+            )
+            return endpoint
+
+        return decorator
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.stale_hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "hit_ratio": (
+                round((self.hits + self.stale_hits + self.coalesced) / lookups, 4)
+                if lookups
+                else 0.0
+            ),
+        }
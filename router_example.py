@@ -1,6 +1,10 @@
 from fastapi import APIRouter
+from response_cache import ResponseCache
 
-router = APIRouter()
+# /items/{item_id} always returns the same response for the same id, so the whole router is cached
+items_cache = ResponseCache(ttl=60, stale_ttl=300, max_entries=10_000)
+
+router = APIRouter(route_class=items_cache.route_class())
 
 
 @router.get("/items/{item_id}")
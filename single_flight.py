@@ -0,0 +1,147 @@
+# Request coalescing ("single flight") for read paths, shared by the apps in this repo.
+#
+# When many identical reads arrive at the same time each one would read the csv or query the database
+# on its own. With a SingleFlight the first caller for a key runs the function, callers that arrive
+# while it is still running wait for it and get the same result (or the same exception). Nothing is
+# cached: once the call is finished the next caller runs the function again.
+#   - do_sync(key, function, ...) for sync code, e.g. endpoints that run in a threadpool (run_in)
+#   - await do(key, coroutine_function, ...) for async code
+#   - @coalesced(flight) wraps an endpoint, sync or async, keyed on its arguments
+#   - single_flight_metrics_router exposes how many calls ran and how many were coalesced
+#
+# Every waiter gets the very same object, so functions should return data nobody changes afterwards
+# (plain dicts or lists of models that are only serialized), not ORM objects tied to one session.
+#
+# The apps live in their own folders and add the repo root to sys.path to import it.
+
+import asyncio
+import functools
+import inspect
+import threading
+
+from fastapi import APIRouter
+
+
+class _Call:
+    __slots__ = ("finished", "result", "error")
+
+    def __init__(self):
+        self.finished = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self.executed = 0  # calls that ran the function
+        self.coalesced = 0  # calls that waited for somebody else's result instead
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._calls: dict = {}  # key -> _Call, sync callers
+        self._tasks: dict = {}  # key -> asyncio.Task, async callers
+
+    def do_sync(self, key, function, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.finished.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = function(*args, **kwargs)
+            return call.result
+        except BaseException as error:
+            call.error = error
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.finished.set()
+
+    async def do(self, key, function, *args, **kwargs):
+        # The function runs as its own task, so a caller that disconnects (and is cancelled) doesn't
+        # cancel the result the others are waiting for. Async callers run on the event loop thread, no
+        # lock is needed for the dict.
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(function(*args, **kwargs))
+            self._tasks[key] = task
+            task.add_done_callback(functools.partial(self._finished, key))
+            with self._lock:
+                self.executed += 1
+        else:
+            with self._lock:
+                self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _finished(self, key, task: asyncio.Task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if task.cancelled() or task.exception() is not None:
+            with self._lock:
+                self.errors += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            calls = self.executed + self.coalesced
+            return {
+                "executed": self.executed,
+                "coalesced": self.coalesced,
+                "errors": self.errors,
+                "in_flight": len(self._calls) + len(self._tasks),
+                "coalesced_ratio": round(self.coalesced / calls, 4) if calls else 0.0,
+            }
+
+
+def coalesced(flight: SingleFlight, key=None, generation=None):
+    # Decorator for an endpoint, put it right above the function (below @run_in for sync endpoints).
+    # FastAPI calls endpoints with keyword arguments only; by default the key is the function name
+    # plus all of them, pass key=lambda **kwargs: ... when some arguments (like a db session) must not
+    # be part of it. functools.wraps keeps the signature for FastAPI.
+    # generation() should return something that changes with every write to the data (a file stamp,
+    # a counter): a request that arrives after a write then never joins a read started before it.
+    def decorator(function):
+        def make_key(kwargs):
+            if key is not None:
+                call_key = key(**kwargs)
+            else:
+                call_key = (function.__qualname__, *sorted(kwargs.items()))
+            if generation is not None:
+                return (generation(), call_key)
+            return call_key
+
+        if inspect.iscoroutinefunction(function):
+
+            @functools.wraps(function)
+            async def async_wrapper(**kwargs):
+                return await flight.do(make_key(kwargs), function, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(**kwargs):
+            return flight.do_sync(make_key(kwargs), function, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def single_flight_metrics_router(*flights: SingleFlight) -> APIRouter:
+    router = APIRouter()
+
+    @router.get("/metrics/single-flight")
+    async def read_single_flight_metrics():
+        return {flight.name: flight.stats() for flight in flights}
+
+    return router
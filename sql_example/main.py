@@ -1,9 +1,41 @@
+import sys
+from pathlib import Path
+
 from fastapi import Depends, FastAPI, HTTPException
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
 from database import SessionLocal, User
 
-app = FastAPI()
+# shared modules (threadpool.py, single_flight.py, ...) live at the repo root
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from threadpool import (
+    ThreadpoolGroup,
+    env_capacity,
+    run_in,
+    threadpool_lifespan,
+    threadpool_metrics_router,
+)
+from single_flight import SingleFlight, single_flight_metrics_router
+
+# sqlalchemy's pool hands out 5 connections plus 10 overflow, more threads than that would only
+# wait for a connection while holding a thread
+db_threads = ThreadpoolGroup("db", env_capacity("DB_THREADS", 15))
+
+app = FastAPI(lifespan=threadpool_lifespan(env_capacity("THREADPOOL_SIZE", 40)))
+app.include_router(threadpool_metrics_router(db_threads))
+
+# concurrent reads of the same user share one query. user_writes goes up after every committed
+# write and is part of the key, so a read sent after a write never gets a query from before it.
+user_reads = SingleFlight("user_reads")
+app.include_router(single_flight_metrics_router(user_reads))
+user_writes = 0
+
+
+def user_written():
+    global user_writes
+    user_writes += 1
+
+
 from database import SessionLocal
 
 
@@ -16,6 +48,7 @@ def get_db():
 
 
 @app.get("/users/")
+@run_in(db_threads)
 def read_users(db: Session = Depends(get_db)):
     users = db.query(User).all()
     return users
@@ -27,18 +60,30 @@ class UserBody(BaseModel):
 
 
 @app.post("/user")
+@run_in(db_threads)
 def add_new_user(user: UserBody, db: Session = Depends(get_db)):
     new_user = User(name=user.name, email=user.email)
     db.add(new_user)
     db.commit()
+    user_written()
     db.refresh(new_user)
     return new_user
 
 
+def load_user(db: Session, user_id: int) -> dict | None:
+    user = db.query(User).filter(User.id == user_id).first()
+    if user is None:
+        return None
+    return {"id": user.id, "name": user.name, "email": user.email}
+
+
 # Reading a specific user
 @app.get("/user")
+@run_in(db_threads)
 def get_user(user_id: int, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
+    # the waiters get the result of another request's session, so the loader returns a plain dict
+    # and not the User object, which belongs to that session
+    user = user_reads.do_sync(("user", user_id, user_writes), load_user, db, user_id)
     if user is None:
         raise HTTPException(status_code=404, detail="User Not Found")
     return user
@@ -46,6 +91,7 @@ def get_user(user_id: int, db: Session = Depends(get_db)):
 
 # Updating a user
 @app.post("/user/{user_id}")
+@run_in(db_threads)
 def update_user(user_id: int, user: UserBody, db: Session = Depends(get_db)):
     db_user = db.query(User).filter(User.id == user_id).first()
     if db_user is None:
@@ -53,16 +99,19 @@ def update_user(user_id: int, user: UserBody, db: Session = Depends(get_db)):
     db_user.name = user.name
     db_user.email = user.email
     db.commit()
+    user_written()
     db.refresh(db_user)
     return db_user
 
 
 # Deleting a user
 @app.delete("/user")
+@run_in(db_threads)
 def delete_user(user_id: int, db: Session = Depends(get_db)):
     db_user = db.query(User).filter(User.id == user_id).first()
     if db_user is None:
         raise HTTPException(status_code=404, detail="User Not Found")
     db.delete(db_user)
     db.commit()
+    user_written()
     return {"details": "User deleted"}
@@ -0,0 +1,113 @@
+# Memory used by the in-memory task list: one pydantic TaskWithId per task (how operations.py used
+# to keep them) against the column-wise TaskTable from store.py.
+#
+#   python benchmark_memory.py                  # 1M tasks
+#   python benchmark_memory.py --tasks 100000
+#
+# Both are parsed from the same csv, the peak is measured with tracemalloc. Filter and search times
+# are printed too, so a smaller footprint doesn't hide a slower endpoint, and for the TaskTable the
+# lookups every write does (index of an id, next_id) along with the memory a dict id -> row would
+# add on top of the columns.
+
+import argparse
+import csv
+import gc
+import io
+import time
+import tracemalloc
+
+from models import TaskWithId
+from store import TaskTable
+
+STATUSES = ["Ready", "Ongoing", "Done"]
+
+
+def make_csv(size: int) -> str:
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(["id", "title", "description", "status"])
+    for number in range(1, size + 1):
+        writer.writerow(
+            [
+                number,
+                f"Task {number}",
+                f"Description of task {number}",
+                STATUSES[number % len(STATUSES)],
+            ]
+        )
+    return output.getvalue()
+
+
+def load_models(text: str) -> list[TaskWithId]:
+    return [TaskWithId(**row) for row in csv.DictReader(io.StringIO(text))]
+
+
+def load_table(text: str) -> TaskTable:
+    return TaskTable.from_csv(io.StringIO(text))
+
+
+def measure(load, text: str):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    tasks = load(text)
+    load_time = time.perf_counter() - start
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return tasks, retained, peak, load_time
+
+
+def time_call(function) -> float:
+    start = time.perf_counter()
+    function()
+    return (time.perf_counter() - start) * 1000  # milliseconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark task list memory usage")
+    parser.add_argument("--tasks", type=int, default=1_000_000)
+    arguments = parser.parse_args()
+
+    text = make_csv(arguments.tasks)
+    megabyte = 1024 * 1024
+
+    models, retained, peak, load_time = measure(load_models, text)
+    filter_time = time_call(lambda: [task for task in models if task.status == "Done"])
+    search_time = time_call(
+        lambda: [
+            task
+            for task in models
+            if "task 99" in (task.title + task.description).lower()
+        ]
+    )
+    print(
+        f"{'':<16}  {'retained':>10}  {'peak':>10}  {'load':>8}  {'filter':>9}  {'search':>9}"
+    )
+    print(
+        f"{'TaskWithId list':<16}  {retained / megabyte:>8.1f}MB  {peak / megabyte:>8.1f}MB"
+        f"  {load_time:>7.2f}s  {filter_time:>7.1f}ms  {search_time:>7.1f}ms"
+    )
+    del models
+
+    table, retained, peak, load_time = measure(load_table, text)
+    filter_time = time_call(lambda: table.filter(status="Done"))
+    search_time = time_call(lambda: table.search("task 99"))
+    print(
+        f"{'TaskTable':<16}  {retained / megabyte:>8.1f}MB  {peak / megabyte:>8.1f}MB"
+        f"  {load_time:>7.2f}s  {filter_time:>7.1f}ms  {search_time:>7.1f}ms"
+    )
+
+    last_id = table.ids[-1]
+    index_time = time_call(lambda: table.index(last_id))
+    next_id_time = time_call(table.next_id)
+    _, dict_size, _, _ = measure(
+        lambda ids: {id: index for index, id in enumerate(ids)}, table.ids
+    )
+    print(
+        f"\nTaskTable lookups: index {index_time:.3f}ms, next_id {next_id_time:.3f}ms"
+        f", a dict id -> row would add {dict_size / megabyte:.1f}MB"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import asyncio
+import json
+import os
+import threading
+import uuid
+from collections import deque
+from typing import Literal, Optional
+
+from pydantic import BaseModel
+
+from models import TaskWithId
+
+# Change feed: every create, modify and delete in operations.py publishes an event with a growing
+# sequence number. Clients keep a cursor ("<epoch>:<seq>") of the last event they saw and only ask
+# for what came after it, instead of downloading GET /tasks again and again.
+# The feed lives in the memory of one process and the numbers start again with every process. The
+# epoch is a random id of this process' feed, a cursor with another epoch (from before a restart, or
+# from another serve.py worker) can't be compared to our numbers.
+# A client without a cursor, with a foreign one or with one older than the last CHANGE_FEED_SIZE
+# events gets resync=True: it should read GET /tasks once, then continue from the returned cursor.
+
+
+class ChangeEvent(BaseModel):
+    seq: int
+    kind: Literal["created", "modified", "deleted"]
+    task_id: int
+    task: Optional[TaskWithId] = None  # None for deleted tasks
+
+
+class ChangesResponse(BaseModel):
+    events: list[ChangeEvent]
+    cursor: str  # pass as `since` of the next request
+    resync: bool = False
+
+
+class ChangeFeed:
+    def __init__(self, max_events: int):
+        self.epoch = uuid.uuid4().hex[:16]
+        self._events: deque[ChangeEvent] = deque(maxlen=max_events)
+        self._last_seq = 0
+        self._lock = threading.Lock()
+        # long-polls and streams waiting for the next event, publish() runs in worker threads so
+        # they are woken up through their event loop
+        self._waiters: set[asyncio.Future] = set()
+
+    @property
+    def last_seq(self) -> int:
+        return self._last_seq
+
+    def cursor(self, seq: int) -> str:
+        return f"{self.epoch}:{seq}"
+
+    def parse_cursor(self, cursor: str | None) -> int | None:
+        # the sequence number of one of our cursors, None for anything else
+        epoch, _, seq = (cursor or "").partition(":")
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def publish(
+        self, kind: str, task_id: int, task: Optional[TaskWithId] = None
+    ) -> ChangeEvent:
+        with self._lock:
+            self._last_seq += 1
+            event = ChangeEvent(
+                seq=self._last_seq, kind=kind, task_id=task_id, task=task
+            )
+            self._events.append(event)
+            waiters, self._waiters = self._waiters, set()
+        for waiter in waiters:
+            waiter.get_loop().call_soon_threadsafe(wake_up, waiter)
+        return event
+
+    def since(self, cursor: str | None) -> ChangesResponse:
+        with self._lock:
+            return self._since_locked(cursor)
+
+    def _since_locked(self, cursor: str | None) -> ChangesResponse:
+        seq = self.parse_cursor(cursor)
+        oldest_seq = self._events[0].seq if self._events else self._last_seq + 1
+        if seq is None or seq > self._last_seq or seq < oldest_seq - 1:
+            return ChangesResponse(
+                events=[], cursor=self.cursor(self._last_seq), resync=True
+            )
+        # sequence numbers have no gaps, so the position in the buffer follows from the number
+        events = list(self._events)[seq - oldest_seq + 1 :]
+        return ChangesResponse(events=events, cursor=self.cursor(self._last_seq))
+
+    async def wait(self, cursor: str | None, timeout: float) -> ChangesResponse:
+        # returns as soon as there is something after the cursor, or an empty response after timeout
+        with self._lock:
+            changes = self._since_locked(cursor)
+            if changes.events or changes.resync or timeout <= 0:
+                return changes
+            waiter = asyncio.get_running_loop().create_future()
+            # added under the lock, so no publish can slip in between
+            self._waiters.add(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+        return self.since(cursor)
+
+
+def wake_up(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+feed = ChangeFeed(int(os.environ.get("CHANGE_FEED_SIZE", 1000)))
+
+
+async def server_sent_events(change_feed: ChangeFeed, cursor: str, heartbeat: float):
+    # text/event-stream body: one "change" message per event with its cursor as the id, so a
+    # reconnecting browser sends it back as Last-Event-ID. A comment line is sent when nothing
+    # happened for `heartbeat` seconds, proxies close connections that stay silent.
+    while True:
+        changes = await change_feed.wait(cursor, heartbeat)
+        if changes.resync:
+            # the id moves the browser's Last-Event-ID to the new cursor as well
+            data = json.dumps({"cursor": changes.cursor})
+            yield f"id: {changes.cursor}\nevent: resync\ndata: {data}\n\n"
+        elif not changes.events:
+            yield ": keep-alive\n\n"
+        for event in changes.events:
+            event_cursor = change_feed.cursor(event.seq)
+            yield f"id: {event_cursor}\nevent: change\ndata: {event.model_dump_json()}\n\n"
+        cursor = changes.cursor
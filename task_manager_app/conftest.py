@@ -25,6 +25,8 @@ import csv, os
 from pathlib import Path
 from unittest.mock import patch
 
+from operations import invalidate_cache
+
 
 @pytest.fixture(
     autouse=True
@@ -45,7 +47,16 @@ def create_test_database():
             writer.writeheader()
             writer.writerows(TEST_TASKS_CSV)
             print("")
+        invalidate_cache()  # the file was written behind the back of operations.py
         yield csv_test  # The fixture pauses here and lets pytest run your test functions.
         os.remove(
             database_file_location
         )  # The temporary CSV file is deleted after testing is done.
+        if os.path.exists(database_file_location + ".lock"):
+            os.remove(database_file_location + ".lock")
+
+
+@pytest.fixture(autouse=True)  # job files go into a temporary folder
+def jobs_directory(tmp_path):
+    with patch("jobs.JOBS_DIRECTORY", str(tmp_path)) as directory:
+        yield directory
@@ -0,0 +1,234 @@
+import csv
+import gzip
+import json
+import os
+import re
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Literal
+
+from pydantic import BaseModel, ValidationError
+
+import operations
+from models import Task
+
+# Export and import of the whole task list run as background jobs: the request only starts the job and
+# returns its id, a worker thread streams through the data in chunks of CHUNK_ROWS rows, and the client
+# polls GET /jobs/{id} until it can download the result. The state of every job is a small json file
+# in JOBS_DIRECTORY, so any uvicorn worker can answer the poll, not only the one running the job.
+
+JOBS_DIRECTORY = "jobs"
+CHUNK_ROWS = 1000
+MAX_REPORTED_ERRORS = 100
+# finished jobs (their .json and export .result) are deleted once they are older than
+# JOB_RETENTION_HOURS or when more than MAX_KEPT_JOBS finished jobs are on disk, whichever comes first
+JOB_RETENTION_HOURS = float(os.getenv("JOB_RETENTION_HOURS", "24"))
+MAX_KEPT_JOBS = int(os.getenv("MAX_KEPT_JOBS", "1000"))
+# an import body larger than this is refused with 413
+MAX_IMPORT_SIZE = int(os.getenv("MAX_IMPORT_SIZE", str(100 * 1024 * 1024)))
+
+job_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("JOB_WORKERS", "2")), thread_name_prefix="jobs"
+)
+
+JOB_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class Job(BaseModel):
+    id: str
+    kind: Literal["export", "import"]
+    format: Literal["csv", "ndjson"]
+    compress: bool = False
+    status: Literal["queued", "running", "done", "failed"] = "queued"
+    processed: int = 0  # rows written (export) or imported (import)
+    rejected: int = 0
+    errors: list[dict] = []
+    error: str | None = None
+
+
+def job_path(job_id: str, suffix: str) -> str:
+    return os.path.join(JOBS_DIRECTORY, job_id + suffix)
+
+
+def result_filename(job: Job) -> str:
+    return f"tasks-{job.id}.{job.format}" + (".gz" if job.compress else "")
+
+
+def save_job(job: Job):
+    os.makedirs(JOBS_DIRECTORY, exist_ok=True)
+    file_descriptor, temporary_filename = tempfile.mkstemp(dir=JOBS_DIRECTORY)
+    with os.fdopen(file_descriptor, "w") as file:
+        file.write(job.model_dump_json())
+    os.replace(temporary_filename, job_path(job.id, ".json"))
+
+
+def load_job(job_id: str) -> Job | None:
+    if not JOB_ID.match(job_id):
+        return None
+    try:
+        with open(job_path(job_id, ".json")) as file:
+            return Job.model_validate_json(file.read())
+    except FileNotFoundError:
+        return None
+
+
+def remove_job_files(job_id: str):
+    for suffix in (".result", ".upload", ".json"):
+        try:
+            os.remove(job_path(job_id, suffix))
+        except FileNotFoundError:
+            pass
+
+
+def prune_jobs():
+    # queued and running jobs are never touched, a download of a result that is removed meanwhile
+    # keeps reading the open file
+    try:
+        names = os.listdir(JOBS_DIRECTORY)
+    except FileNotFoundError:
+        return
+    finished = []
+    for name in names:
+        job_id, suffix = os.path.splitext(name)
+        if suffix != ".json" or not JOB_ID.match(job_id):
+            continue
+        job = load_job(job_id)
+        if job is None or job.status not in ("done", "failed"):
+            continue
+        try:
+            finished.append((os.path.getmtime(job_path(job_id, ".json")), job_id))
+        except FileNotFoundError:
+            pass
+    finished.sort(reverse=True)
+    oldest_kept = time.time() - JOB_RETENTION_HOURS * 3600
+    for position, (modified, job_id) in enumerate(finished):
+        if position >= MAX_KEPT_JOBS or modified < oldest_kept:
+            remove_job_files(job_id)
+
+
+def new_job(kind: str, format: str, compress: bool = False) -> Job:
+    prune_jobs()
+    job = Job(id=uuid.uuid4().hex, kind=kind, format=format, compress=compress)
+    save_job(job)
+    return job
+
+
+def run_job(job: Job, work):
+    job.status = "running"
+    save_job(job)
+    try:
+        work(job)
+        job.status = "done"
+    except Exception as exc:
+        job.status = "failed"
+        job.error = str(exc)
+    save_job(job)
+
+
+def chunks(iterable, size: int):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def export_tasks(job: Job):
+    output_path = job_path(job.id, ".result")
+    opener = gzip.open if job.compress else open
+    with operations.open_snapshot() as rows, opener(
+        output_path, mode="wt", newline=""
+    ) as output:
+        if job.format == "csv":
+            writer = csv.DictWriter(output, fieldnames=operations.column_fields)
+            writer.writeheader()
+        for chunk in chunks(rows, CHUNK_ROWS):
+            if job.format == "csv":
+                writer.writerows(
+                    {field: row[field] for field in operations.column_fields}
+                    for row in chunk
+                )
+            else:
+                output.writelines(
+                    json.dumps(
+                        {
+                            **{field: row[field] for field in operations.column_fields},
+                            "id": int(row["id"]),
+                        }
+                    )
+                    + "\n"
+                    for row in chunk
+                )
+            job.processed += len(chunk)
+            save_job(job)
+
+
+def open_upload(path: str):
+    # gzip is recognised by its first two bytes, whatever the client called the file
+    with open(path, "rb") as file:
+        magic = file.read(2)
+    if magic == b"\x1f\x8b":
+        return gzip.open(path, mode="rt", encoding="utf-8", newline="")
+    return open(path, mode="r", encoding="utf-8", newline="")
+
+
+def import_tasks(job: Job):
+    upload_path = job_path(job.id, ".upload")
+    try:
+        with open_upload(upload_path) as file:
+            if job.format == "csv":
+                records = enumerate(
+                    csv.DictReader(file), start=2
+                )  # line 1 is the header
+            else:
+                records = (
+                    (number, line)
+                    for number, line in enumerate(file, start=1)
+                    if line.strip()
+                )
+            for chunk in chunks(records, CHUNK_ROWS):
+                tasks = []
+                for number, record in chunk:
+                    try:
+                        if job.format == "csv":
+                            tasks.append(Task.model_validate(record))
+                        else:
+                            tasks.append(Task.model_validate_json(record))
+                    except ValidationError as exc:
+                        job.rejected += 1
+                        if len(job.errors) < MAX_REPORTED_ERRORS:
+                            job.errors.append(
+                                {
+                                    "line": number,
+                                    "error": exc.errors(include_url=False)[0]["msg"],
+                                }
+                            )
+                if tasks:
+                    operations.append_tasks(tasks)
+                job.processed += len(tasks)
+                save_job(job)
+    finally:
+        os.remove(upload_path)
+
+
+def start_export(format: str, compress: bool) -> Job:
+    job = new_job("export", format, compress)
+    job_executor.submit(run_job, job, export_tasks)
+    return job
+
+
+def fail_upload(job: Job, error: str):
+    # the body of an import never fully arrived, so the job will never run
+    job.status = "failed"
+    job.error = error
+    save_job(job)
+    try:
+        os.remove(job_path(job.id, ".upload"))
+    except FileNotFoundError:
+        pass
+
+
+def start_import(job: Job) -> Job:
+    job_executor.submit(run_job, job, import_tasks)
+    return job
@@ -0,0 +1,28 @@
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None
+    import msvcrt
+
+
+@contextmanager
+def file_lock(path: str, exclusive: bool):
+    # Advisory lock on a separate lock file, shared by every process (uvicorn worker) and every thread
+    # that opens it. Readers take a shared lock, writers an exclusive one, so a writer waits for the
+    # readers and the other writers. Windows has no shared locks, there every lock is exclusive.
+    with open(path, "a+b") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
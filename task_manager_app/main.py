@@ -1,43 +1,73 @@
+import sys
+from pathlib import Path
+
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 from models import Task, TaskWithId
 from operations import (
-    read_all_tasks,
     read_task,
     create_task,
     modify_task,
     remove_task,
     read_all_tasks_v2,
+    filter_tasks,
+    find_tasks,
 )
 from typing import Optional
+import operations
+
+# shared modules (threadpool.py, single_flight.py, ...) live at the repo root
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from threadpool import (
+    ThreadpoolGroup,
+    env_capacity,
+    run_in,
+    threadpool_lifespan,
+    threadpool_metrics_router,
+)
+from single_flight import SingleFlight, coalesced, single_flight_metrics_router
+
+# routes that mostly wait on the csv file and routes that mostly burn cpu get separate threads,
+# so a burst of searches can't starve plain reads and writes
+io_threads = ThreadpoolGroup("io", env_capacity("IO_THREADS", 32))
+cpu_threads = ThreadpoolGroup("cpu", env_capacity("CPU_THREADS", 4))
 
 app = FastAPI(
-    title="Task Manager API", description="This is a task manager Api", version="0.1.0"
+    title="Task Manager API",
+    description="This is a task manager Api",
+    version="0.1.0",
+    lifespan=threadpool_lifespan(env_capacity("THREADPOOL_SIZE", 40)),
 )
+app.include_router(threadpool_metrics_router(io_threads, cpu_threads))
+
+# identical list and search requests that arrive together share one read of the tasks. The stamp of
+# the csv is part of the key, so a request sent after a write never gets a read from before it.
+task_reads = SingleFlight("task_reads")
+
+
+def tasks_generation():
+    return operations.file_stamp(operations.DATABASE_FILENAME)
+
+
+app.include_router(single_flight_metrics_router(task_reads))
 
 
 @app.get("/tasks", response_model=list[TaskWithId])
+@run_in(io_threads)
+@coalesced(task_reads, generation=tasks_generation)
 def get_tasks(status: Optional[str] = None, title: Optional[str] = None):
-    tasks = read_all_tasks()
-    if status:
-        task = [task for task in tasks if task.status == status]
-        if title:
-            tasks = [task for task in tasks if task.title == title]
-    return tasks
+    return filter_tasks(status or None, title or None)
 
 
 @app.get("/tasks/search", response_model=list[TaskWithId])
+@run_in(cpu_threads)
+@coalesced(task_reads, generation=tasks_generation)
 def search_tasks(keyword: str):
-    tasks = read_all_tasks()
-    filtered_tasks = [
-        task
-        for task in tasks
-        if keyword.lower() in (task.title + task.description).lower()
-    ]
-    return filtered_tasks
+    return find_tasks(keyword)
 
 
 @app.get("/task/{task_id}")
+@run_in(io_threads)
 def get_task(task_id: int):
     task = read_task(task_id)
     if not task:
@@ -46,6 +76,7 @@ def get_task(task_id: int):
 
 
 @app.post("/task", response_model=TaskWithId)
+@run_in(io_threads)
 def add_task(task: Task):
     return create_task(task)
 
@@ -57,6 +88,7 @@ class UdpdateTask(BaseModel):
 
 
 @app.put("/task/{task_id}", response_model=TaskWithId)
+@run_in(io_threads)
 def update_task(task_id: int, task_update: UdpdateTask):
     modified = modify_task(task_id, task_update.model_dump(exclude_unset=True))
     if not modified:
@@ -65,6 +97,7 @@ def update_task(task_id: int, task_update: UdpdateTask):
 
 
 @app.delete("/task/{task_id}", response_model=Task)
+@run_in(io_threads)
 def delete_task(task_id: int):
     removed_task = remove_task(task_id)
     if not removed_task:
@@ -76,6 +109,7 @@ from models import TaskV2WithID
 
 
 @app.get("/v2/tasks", response_model=list[TaskV2WithID])
+@run_in(io_threads)
 def get_tasks_v2():
     tasks = read_all_tasks_v2()
     return tasks
@@ -115,3 +149,111 @@ def read_users_me(
     current_user: User = Depends(get_user_from_token),
 ):
     return current_user
+
+
+import os
+import anyio
+from typing import Literal
+from fastapi import Request
+from fastapi.responses import FileResponse
+import jobs
+
+
+@app.post("/tasks/export", response_model=jobs.Job, status_code=202)
+@run_in(io_threads)
+def start_tasks_export(
+    format: Literal["csv", "ndjson"] = "csv", compress: bool = False
+):
+    return jobs.start_export(format, compress)
+
+
+@app.post("/tasks/import", response_model=jobs.Job, status_code=202)
+async def start_tasks_import(
+    request: Request, format: Literal["csv", "ndjson"] = "csv"
+):
+    # the body (csv or ndjson, optionally gzipped) is streamed to disk, the job reads it from there
+    too_large = HTTPException(
+        status_code=413,
+        detail=f"Import larger than {jobs.MAX_IMPORT_SIZE} bytes",
+    )
+    if int(request.headers.get("content-length") or 0) > jobs.MAX_IMPORT_SIZE:
+        raise too_large
+    job = await anyio.to_thread.run_sync(jobs.new_job, "import", format)
+    received = 0
+    try:
+        async with await anyio.open_file(
+            jobs.job_path(job.id, ".upload"), "wb"
+        ) as upload:
+            async for chunk in request.stream():
+                # chunked bodies have no content-length, so count what actually arrives
+                received += len(chunk)
+                if received > jobs.MAX_IMPORT_SIZE:
+                    break
+                await upload.write(chunk)
+    except BaseException as exc:
+        # client disconnected or the body broke off: don't leave the job "queued" forever.
+        # Shielded, a cancelled request would otherwise cancel the cleanup too.
+        with anyio.CancelScope(shield=True):
+            await anyio.to_thread.run_sync(
+                jobs.fail_upload, job, f"Upload interrupted: {exc!r}"
+            )
+        raise
+    if received > jobs.MAX_IMPORT_SIZE:
+        await anyio.to_thread.run_sync(jobs.fail_upload, job, too_large.detail)
+        raise too_large
+    return jobs.start_import(job)
+
+
+@app.get("/jobs/{job_id}", response_model=jobs.Job)
+@run_in(io_threads)
+def read_job(job_id: str):
+    job = jobs.load_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/jobs/{job_id}/download")
+@run_in(io_threads)
+def download_job_result(job_id: str):
+    job = jobs.load_job(job_id)
+    if job is None or job.kind != "export":
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    media_type = "text/csv" if job.format == "csv" else "application/x-ndjson"
+    return FileResponse(
+        jobs.job_path(job.id, ".result"),
+        filename=jobs.result_filename(job),
+        media_type="application/gzip" if job.compress else media_type,
+    )
+
+
+from fastapi import Header, Query
+from fastapi.responses import StreamingResponse
+from changes import ChangesResponse, feed, server_sent_events
+
+
+@app.get("/tasks/changes", response_model=ChangesResponse)
+async def read_task_changes(
+    since: Optional[str] = None,
+    timeout: float = Query(25, ge=0, le=60),
+):
+    # long-poll: answers right away if there are events after the cursor `since`, otherwise waits up
+    # to `timeout` seconds for one. Send the returned cursor as `since` of the next request.
+    return await feed.wait(since, timeout)
+
+
+@app.get("/tasks/changes/stream")
+async def stream_task_changes(
+    since: Optional[str] = None,
+    last_event_id: Optional[str] = Header(None),
+):
+    # Server-Sent Events, usable with the browser's EventSource. Without a cursor the stream starts
+    # at the current end of the feed.
+    cursor = last_event_id or since or feed.cursor(feed.last_seq)
+    return StreamingResponse(
+        server_sent_events(feed, cursor, float(os.environ.get("SSE_HEARTBEAT", 15))),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
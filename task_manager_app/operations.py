@@ -1,93 +1,214 @@
 import csv
+import os
+import tempfile
+from contextlib import contextmanager
+from itertools import islice
 from typing import Optional
 
+from changes import feed
+from locking import file_lock
 from models import Task, TaskWithId
+from store import STATUSES, TaskTable
 
 DATABASE_FILENAME = "tasks.csv"
 
 column_fields = ["id", "title", "description", "status"]
 
+# Several uvicorn workers can share the csv file (see serve.py):
+#   - every change happens under an exclusive lock on DATABASE_FILENAME + ".lock", reads take a shared lock
+#   - rewrites go to a temporary file that replaces the csv in one step, so a reader never sees half a file
+#   - each process keeps the parsed tasks in memory together with a stamp of the file (inode, size and
+#     modification time). A single os.stat() tells whether another worker wrote since, only then the
+#     file is read again.
+# The tasks are kept in a compact TaskTable (see store.py), pydantic models are only built for the
+# tasks an endpoint returns. A table is never changed in place, writers build a new one.
+_cache: tuple = (None, None, TaskTable())  # (filename, stamp, table)
+
+
+def file_stamp(filename: str):
+    try:
+        stat_result = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return (stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns)
+
+
+def invalidate_cache():
+    global _cache
+    _cache = (None, None, TaskTable())
+
+
+def lock_filename() -> str:
+    return DATABASE_FILENAME + ".lock"
+
+
+@contextmanager
+def locked_for_writing():
+    with file_lock(lock_filename(), exclusive=True):
+        yield
+
+
+def load_table_unlocked() -> TaskTable:
+    # the caller holds the lock
+    global _cache
+    filename = DATABASE_FILENAME
+    stamp = file_stamp(filename)
+    if stamp is None:
+        return TaskTable()
+    cached_filename, cached_stamp, table = _cache
+    if (cached_filename, cached_stamp) == (filename, stamp):
+        return table
+    with open(filename, newline="") as csvfile:
+        table = TaskTable.from_csv(csvfile)
+    _cache = (filename, stamp, table)
+    return table
+
+
+def store_table_unlocked(table: TaskTable):
+    # after our own write the new table is already known, no need to read the file again
+    global _cache
+    _cache = (DATABASE_FILENAME, file_stamp(DATABASE_FILENAME), table)
+
+
+def load_table() -> TaskTable:
+    cached_filename, cached_stamp, table = _cache
+    if cached_filename == DATABASE_FILENAME and cached_stamp == file_stamp(
+        DATABASE_FILENAME
+    ):
+        return table  # nobody wrote since we last read the file, no lock needed
+    with file_lock(lock_filename(), exclusive=False):
+        return load_table_unlocked()
+
 
 def read_all_tasks() -> list[TaskWithId]:  # returns a list TaskwithId objects
-    with open(DATABASE_FILENAME) as csvfile:
-        reader = csv.DictReader(
-            csvfile
-        )  # reads a csv where each row becomes a dictionary
-        return [
-            TaskWithId(**row) for row in reader
-        ]  # It reads each line of the CSV and converts it into a Pydantic model, then returns ALL those models as a list.
+    return load_table().materialize_all()
 
 
 def read_task(task_id) -> Optional[TaskWithId]:
-    with open(DATABASE_FILENAME) as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            if int(row["id"]) == task_id:
-                return TaskWithId(**row)
+    table = load_table()
+    index = table.index(task_id)
+    if index is not None:
+        return table.materialize(index)
 
 
-def get_next_id():
-    try:
-        with open(DATABASE_FILENAME, "r") as csvfile:
-            reader = csv.DictReader(csvfile)
-            max_id = max(int(row["id"]) for row in reader)
-            return max_id + 1
-    except (FileNotFoundError, ValueError):
-        return 1
+def filter_tasks(
+    status: str | None = None, title: str | None = None
+) -> list[TaskWithId]:
+    table = load_table()
+    return table.materialize_all(table.filter(status, title))
+
+
+def find_tasks(keyword: str) -> list[TaskWithId]:
+    table = load_table()
+    return table.materialize_all(table.search(keyword))
 
 
-def write_task_into_csv(task: TaskWithId):
+def append_rows_to_csv(rows):
     with open(DATABASE_FILENAME, mode="a", newline="") as file:
-        writer = csv.DictWriter(file, fieldnames=column_fields)
-        writer.writerow(task.model_dump())
+        csv.writer(file).writerows(rows)
+
+
+def rewrite_csv(table: TaskTable):
+    # write everything into a temporary file in the same folder, then swap it in with one rename
+    directory = os.path.dirname(os.path.abspath(DATABASE_FILENAME))
+    file_descriptor, temporary_filename = tempfile.mkstemp(
+        dir=directory, prefix=".tasks-", suffix=".csv"
+    )
+    try:
+        with os.fdopen(file_descriptor, mode="w", newline="") as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(column_fields)
+            writer.writerows(table.rows())
+        os.replace(temporary_filename, DATABASE_FILENAME)
+    except BaseException:
+        os.unlink(temporary_filename)
+        raise
+
+
+def append_tasks(tasks: list[Task]) -> list[TaskWithId]:
+    # adds tasks with one lock and one write, create_task and the import jobs use it
+    with locked_for_writing():
+        table = load_table_unlocked().copy()
+        first_index = len(table)
+        next_id = table.next_id()  # ids can't collide with another worker's
+        for number, task in enumerate(tasks):
+            table.append(next_id + number, task.title, task.description, task.status)
+        if file_stamp(DATABASE_FILENAME) is None:
+            rewrite_csv(table)  # first tasks, the file still needs its header
+        else:
+            append_rows_to_csv(islice(table.rows(), first_index, None))
+        store_table_unlocked(table)
+        created_tasks = table.materialize_all(range(first_index, len(table)))
+        for task in created_tasks:  # still under the lock, so events come in file order
+            feed.publish("created", task.id, task)
+    return created_tasks
+
+
+@contextmanager
+def open_snapshot():
+    # Yields a csv.DictReader over the file as it is right now, without holding the lock while it is
+    # read: rewrites replace the file (our handle keeps the old one) and appends only add bytes after
+    # the size we noted, which are skipped.
+    with file_lock(lock_filename(), exclusive=False):
+        csvfile = open(DATABASE_FILENAME, mode="rb")
+        size = os.fstat(csvfile.fileno()).st_size
+
+    def snapshot_lines():
+        remaining = size
+        for line in csvfile:
+            if remaining <= 0:
+                return
+            remaining -= len(line)
+            yield line.decode("utf-8")
+
+    try:
+        yield csv.DictReader(snapshot_lines())
+    finally:
+        csvfile.close()
 
 
 def create_task(task: Task) -> TaskWithId:
-    id = get_next_id()
-    task_with_id = TaskWithId(id=id, **task.model_dump())
-    write_task_into_csv(task_with_id)
-    return task_with_id
+    return append_tasks([task])[0]
 
 
 def modify_task(id: int, task: dict) -> Optional[TaskWithId]:
-    updated_task: Optional[TaskWithId] = None
-    tasks = read_all_tasks()
-    for number, task_ in enumerate(tasks):
-        if task_.id == id:
-            tasks[number] = updated_task = task_.model_copy(update=task)
-    with open(DATABASE_FILENAME, mode="w", newline="") as csvfile:  # rewrite the file
-        writer = csv.DictWriter(
-            csvfile,
-            fieldnames=column_fields,
-        )
-        writer.writeheader()
-        for task in tasks:
-            writer.writerow(task.model_dump())
-    if updated_task:
-        return updated_task
-
-
-def remove_task(id: int) -> bool:
-    deleted_task: Optional[Task] = None
-    tasks = read_all_tasks()
-    with open(DATABASE_FILENAME, mode="w", newline="") as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=column_fields)
-        writer.writeheader()
-        for task in tasks:
-            if task.id == id:
-                deleted_task = task
-                continue
-            writer.writerow(task.model_dump())
-            if deleted_task:
-                dict_task_without_id = deleted_task.model_dump()
-                del dict_task_without_id["id"]
-                return Task(**dict_task_without_id)
+    with locked_for_writing():
+        table = load_table_unlocked()
+        index = table.index(id)
+        if index is None:
+            return None
+        updated_task = table.materialize(index).model_copy(update=task)
+        table = table.copy()
+        table.titles[index] = updated_task.title
+        table.descriptions[index] = updated_task.description
+        table.status_codes[index] = STATUSES.code(updated_task.status)
+        rewrite_csv(table)
+        store_table_unlocked(table)
+        feed.publish("modified", id, updated_task)
+    return updated_task
+
+
+def remove_task(id: int) -> Optional[Task]:
+    with locked_for_writing():
+        table = load_table_unlocked()
+        index = table.index(id)
+        if index is None:
+            return None
+        deleted_task = table.materialize(index)
+        table = table.without(index)
+        rewrite_csv(table)
+        store_table_unlocked(table)
+        feed.publish("deleted", id)
+    dict_task_without_id = deleted_task.model_dump()
+    del dict_task_without_id["id"]
+    return Task(**dict_task_without_id)
 
 
 from models import TaskV2WithID
 
 
 def read_all_tasks_v2() -> list[TaskV2WithID]:
-    with open(DATABASE_FILENAME) as csvfile:
-        reader = csv.DictReader(csvfile)
-        return [TaskV2WithID(**row) for row in reader]
+    with file_lock(lock_filename(), exclusive=False):
+        with open(DATABASE_FILENAME) as csvfile:
+            reader = csv.DictReader(csvfile)
+            return [TaskV2WithID(**row) for row in reader]
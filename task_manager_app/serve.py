@@ -0,0 +1,33 @@
+# Runs the task manager with several worker processes, all sharing tasks.csv.
+#
+#   python serve.py --workers 4 --port 8000
+#
+# Every worker is a separate python process with its own memory, operations.py keeps them consistent
+# with a lock file and a cheap check of the csv's stamp before using its in-memory copy.
+
+import argparse
+import os
+from pathlib import Path
+
+import uvicorn
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the task manager with N workers")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    arguments = parser.parse_args()
+    app_directory = Path(__file__).resolve().parent
+    os.chdir(app_directory)  # DATABASE_FILENAME is relative to the app folder
+    uvicorn.run(
+        "main:app",
+        app_dir=str(app_directory),
+        host=arguments.host,
+        port=arguments.port,
+        workers=arguments.workers,
+    )
+
+
+if __name__ == "__main__":
+    main()
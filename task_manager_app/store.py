@@ -0,0 +1,172 @@
+import csv
+import threading
+from array import array
+from bisect import bisect_left
+
+from models import TaskWithId
+
+# Compact in-memory form of the task list. Instead of one pydantic TaskWithId per row (hundreds of
+# bytes of object overhead each) the tasks are stored column by column:
+#   ids           array of 64 bit ints, 8 bytes per task
+#   titles        list of str
+#   descriptions  list of str
+#   status_codes  array of 32 bit ints, every distinct status string is stored once in STATUSES
+#                 (statuses are free text and the vocabulary never forgets one, 16 bits ran out)
+# Pydantic models are only created for the tasks an endpoint actually returns (materialize).
+# Lookups by id don't need a dict (a dict id -> row costs ~100 bytes per task, more than the columns
+# themselves, see benchmark_memory.py): new ids are always max_id + 1, so the ids column stays
+# sorted and index() can bisect it. Only a csv written with ids out of order falls back to a scan.
+
+
+class StatusVocabulary:
+    # append-only, so a code never changes meaning and tables can share it between threads
+    def __init__(self):
+        self.names: list[str] = []
+        self.codes: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def code(self, name: str) -> int:
+        code = self.codes.get(name)
+        if code is None:
+            with self._lock:
+                code = self.codes.get(name)
+                if code is None:
+                    code = len(self.names)
+                    self.names.append(name)
+                    self.codes[name] = code
+        return code
+
+
+STATUSES = StatusVocabulary()
+
+
+class TaskTable:
+    __slots__ = ("ids", "titles", "descriptions", "status_codes", "max_id", "ascending")
+
+    def __init__(self):
+        self.ids = array("q")
+        self.titles: list[str] = []
+        self.descriptions: list[str] = []
+        self.status_codes = array("I")
+        self.max_id = 0
+        self.ascending = True  # every id larger than the one before, index() can bisect
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, id: int, title: str, description: str, status: str):
+        # only the first append can still fail (an id that isn't a 64 bit int), so a failed append
+        # never leaves the columns with different lengths
+        status_code = STATUSES.code(status)
+        ascending = self.ascending and (not self.ids or id > self.ids[-1])
+        self.ids.append(id)
+        self.titles.append(title)
+        self.descriptions.append(description)
+        self.status_codes.append(status_code)
+        self.ascending = ascending
+        self.max_id = max(self.max_id, id)
+
+    @classmethod
+    def from_csv(cls, csvfile) -> "TaskTable":
+        table = cls()
+        reader = csv.reader(csvfile)
+        header = next(reader, None)
+        if header is None:
+            return table
+        id_column, title_column, description_column, status_column = (
+            header.index(field) for field in ("id", "title", "description", "status")
+        )
+        for row in reader:
+            table.append(
+                int(row[id_column]),
+                row[title_column],
+                row[description_column],
+                row[status_column],
+            )
+        return table
+
+    def copy(self) -> "TaskTable":
+        # tables are never changed once other threads can see them, writers change a copy
+        table = TaskTable()
+        table.ids = array("q", self.ids)
+        table.titles = list(self.titles)
+        table.descriptions = list(self.descriptions)
+        table.status_codes = array("I", self.status_codes)
+        table.max_id = self.max_id
+        table.ascending = self.ascending
+        return table
+
+    def without(self, index: int) -> "TaskTable":
+        table = self.copy()
+        del table.ids[index]
+        del table.titles[index]
+        del table.descriptions[index]
+        del table.status_codes[index]
+        if self.ids[index] == self.max_id:
+            # the same as a table read back from the csv, which no longer has the row either
+            table.max_id = max(table.ids, default=0)
+        return table
+
+    def index(self, id: int) -> int | None:
+        if self.ascending:
+            index = bisect_left(self.ids, id)
+            if index < len(self.ids) and self.ids[index] == id:
+                return index
+            return None
+        try:
+            return self.ids.index(id)
+        except ValueError:
+            return None
+
+    def status(self, index: int) -> str:
+        return STATUSES.names[self.status_codes[index]]
+
+    def next_id(self) -> int:
+        return self.max_id + 1
+
+    def rows(self):
+        # (id, title, description, status) tuples, in the order of column_fields
+        names = STATUSES.names
+        for id, title, description, status_code in zip(
+            self.ids, self.titles, self.descriptions, self.status_codes
+        ):
+            yield id, title, description, names[status_code]
+
+    def filter(self, status: str | None = None, title: str | None = None) -> list[int]:
+        if status is not None:
+            status_code = STATUSES.codes.get(status)
+            if status_code is None:
+                return []
+            indexes = [
+                index
+                for index, code in enumerate(self.status_codes)
+                if code == status_code
+            ]
+        else:
+            indexes = range(len(self))
+        if title is not None:
+            indexes = [index for index in indexes if self.titles[index] == title]
+        return list(indexes)
+
+    def search(self, keyword: str) -> list[int]:
+        keyword = keyword.lower()
+        return [
+            index
+            for index, (title, description) in enumerate(
+                zip(self.titles, self.descriptions)
+            )
+            if keyword in (title + description).lower()
+        ]
+
+    def materialize(self, index: int) -> TaskWithId:
+        return TaskWithId.model_construct(  # the values were validated when they were stored
+            id=self.ids[index],
+            title=self.titles[index],
+            description=self.descriptions[index],
+            status=self.status(index),
+        )
+
+    def materialize_all(self, indexes=None) -> list[TaskWithId]:
+        if indexes is None:
+            indexes = range(len(self))
+        return [self.materialize(index) for index in indexes]
@@ -67,3 +67,398 @@ def test_endpoint_delete_task():
 
     assert response.json() == expected_response
     assert read_task(2) is None
+
+
+def test_endpoint_threadpool_metrics():
+    client.get("/tasks")
+    client.get("/tasks/search", params={"keyword": "one"})
+    response = client.get("/metrics/threadpool")
+    assert response.status_code == 200
+    metrics = response.json()
+    assert {"default", "io", "cpu"} <= metrics.keys()
+    assert metrics["io"]["calls"] >= 1
+    assert metrics["cpu"]["calls"] >= 1
+    assert metrics["io"]["busy"] == 0
+    assert {"capacity", "queued", "avg_wait_ms", "max_wait_ms"} <= metrics["io"].keys()
+
+
+import csv
+import os
+from multiprocessing import Process
+
+import operations
+from conftest import TEST_TASKS_CSV
+
+
+def test_read_sees_writes_of_other_workers():
+    assert len(read_all_tasks()) == 2  # now cached in this process
+    # another worker rewrites the file
+    other_file = operations.DATABASE_FILENAME + ".other"
+    with open(other_file, mode="w", newline="") as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=operations.column_fields)
+        writer.writeheader()
+        writer.writerows(TEST_TASKS_CSV[:1])
+    os.replace(other_file, operations.DATABASE_FILENAME)
+    assert len(read_all_tasks()) == 1
+    assert client.get("/task/2").status_code == 404
+
+
+def create_tasks_in_worker(database_filename: str, count: int):
+    operations.DATABASE_FILENAME = database_filename
+    operations.invalidate_cache()
+    for number in range(count):
+        operations.create_task(
+            operations.Task(title=f"Task {number}", description="", status="Ready")
+        )
+        operations.modify_task(1, {"status": f"Changed {os.getpid()}"})
+
+
+def test_concurrent_workers_do_not_lose_writes():
+    workers = [
+        Process(target=create_tasks_in_worker, args=(operations.DATABASE_FILENAME, 20))
+        for _ in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    tasks = read_all_tasks()
+    assert len(tasks) == 2 + 4 * 20
+    assert sorted(task.id for task in tasks) == list(range(1, 2 + 4 * 20 + 1))
+
+
+import gzip
+import json
+import time
+
+import pytest
+
+import jobs
+
+
+def wait_for_job(job_id: str) -> dict:
+    for _ in range(100):
+        job = client.get(f"/jobs/{job_id}").json()
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.02)
+    raise AssertionError("job did not finish")
+
+
+def test_export_job_csv():
+    response = client.post("/tasks/export")
+    assert response.status_code == 202
+    job = wait_for_job(response.json()["id"])
+    assert (job["status"], job["processed"]) == ("done", 2)
+
+    response = client.get(f"/jobs/{job['id']}/download")
+    assert response.status_code == 200
+    rows = list(csv.DictReader(response.text.splitlines()))
+    assert rows == TEST_TASKS_CSV
+
+
+def test_export_job_ndjson_gzip():
+    response = client.post(
+        "/tasks/export", params={"format": "ndjson", "compress": True}
+    )
+    job = wait_for_job(response.json()["id"])
+    response = client.get(f"/jobs/{job['id']}/download")
+    assert response.headers["content-disposition"].endswith('.ndjson.gz"')
+    lines = gzip.decompress(response.content).decode().splitlines()
+    assert [json.loads(line) for line in lines] == [
+        {**task, "id": int(task["id"])} for task in TEST_TASKS_CSV
+    ]
+
+
+def test_import_job():
+    body = "title,description,status\nImported,From csv,Ready\nNo status\n"
+    response = client.post("/tasks/import", content=body)
+    assert response.status_code == 202
+    job = wait_for_job(response.json()["id"])
+    assert (job["status"], job["processed"], job["rejected"]) == ("done", 1, 1)
+    assert job["errors"][0]["line"] == 3
+
+    lines = [
+        json.dumps({"title": f"Task {number}", "description": "", "status": "Ready"})
+        for number in range(5)
+    ]
+    response = client.post(
+        "/tasks/import",
+        params={"format": "ndjson"},
+        content=gzip.compress("\n".join(lines).encode()),
+    )
+    job = wait_for_job(response.json()["id"])
+    assert job["processed"] == 5
+    assert [task.id for task in read_all_tasks()] == list(range(1, 2 + 1 + 5 + 1))
+
+
+def test_import_job_fails_when_client_disconnects(jobs_directory):
+    # raw ASGI call: one piece of the body, then the client goes away
+    messages = [
+        {
+            "type": "http.request",
+            "body": b"title,description,status\n",
+            "more_body": True,
+        },
+        {"type": "http.disconnect"},
+    ]
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        pass
+
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/tasks/import",
+        "query_string": b"",
+        "headers": [],
+    }
+    with pytest.raises(Exception):
+        anyio.run(app, scope, receive, send)
+    [job_file] = os.listdir(jobs_directory)
+    job = client.get(f"/jobs/{job_file.removesuffix('.json')}").json()
+    assert job["status"] == "failed"
+    assert "Upload interrupted" in job["error"]
+
+
+def test_import_larger_than_the_limit_is_refused(jobs_directory):
+    body = "title,description,status\n" + "Imported,From csv,Ready\n" * 10
+    with patch("jobs.MAX_IMPORT_SIZE", 100):
+        response = client.post("/tasks/import", content=body)
+        assert response.status_code == 413
+        assert os.listdir(jobs_directory) == []
+
+        # a chunked body has no content-length, it is stopped once the limit is reached
+        response = client.post(
+            "/tasks/import", content=(line.encode() for line in body.splitlines(True))
+        )
+        assert response.status_code == 413
+    [job_file] = os.listdir(jobs_directory)
+    job = jobs.load_job(job_file.removesuffix(".json"))
+    assert (job.status, job.processed) == ("failed", 0)
+
+
+def test_finished_jobs_are_pruned(jobs_directory):
+    finished = [jobs.new_job("export", "csv") for _ in range(3)]
+    for job in finished:
+        job.status = "done"
+        jobs.save_job(job)
+        open(jobs.job_path(job.id, ".result"), "w").close()
+    running = jobs.new_job("export", "csv")
+    # the oldest finished job is past the retention time, the running one never goes
+    now = time.time()
+    for job, age in ((finished[0], 48), (running, 48), (finished[1], 2)):
+        modified = now - age * 3600
+        os.utime(jobs.job_path(job.id, ".json"), (modified, modified))
+
+    with patch("jobs.MAX_KEPT_JOBS", 1):
+        jobs.new_job("export", "csv")
+    kept = set(os.listdir(jobs_directory))
+    assert f"{finished[0].id}.json" not in kept
+    assert f"{finished[1].id}.json" not in kept
+    assert f"{finished[1].id}.result" not in kept
+    assert {f"{finished[2].id}.json", f"{finished[2].id}.result"} <= kept
+    assert f"{running.id}.json" in kept
+
+
+def test_job_not_found_or_not_ready():
+    assert client.get("/jobs/unknown").status_code == 404
+    job = client.post("/tasks/import", content="title,description,status\n").json()
+    wait_for_job(job["id"])
+    assert client.get(f"/jobs/{job['id']}/download").status_code == 404
+
+
+def test_endpoint_filter_and_search_tasks():
+    response = client.get("/tasks", params={"status": "Ongoing"})
+    assert response.json() == [TEST_TASKS_CSV[1] | {"id": 2}]
+    response = client.get(
+        "/tasks", params={"status": "Incomplete", "title": "Test Task Two"}
+    )
+    assert response.json() == []
+    assert client.get("/tasks", params={"status": "Unknown"}).json() == []
+
+    response = client.get("/tasks/search", params={"keyword": "description ONE"})
+    assert [task["id"] for task in response.json()] == [1]
+
+
+import anyio
+from changes import ChangeFeed, feed, server_sent_events
+
+
+def test_long_poll_task_changes():
+    response = client.get("/tasks/changes", params={"timeout": 0})
+    assert response.json()["resync"] is True  # no cursor yet
+    since = response.json()["cursor"]
+    response = client.get("/tasks/changes", params={"since": since, "timeout": 0})
+    assert response.json() == {"events": [], "cursor": since, "resync": False}
+
+    client.put("/task/1", json={"status": "Done"})
+    client.delete("/task/2")
+    changes = client.get("/tasks/changes", params={"since": since}).json()
+    assert [(event["kind"], event["task_id"]) for event in changes["events"]] == [
+        ("modified", 1),
+        ("deleted", 2),
+    ]
+    assert changes["events"][0]["task"]["status"] == "Done"
+    assert changes["cursor"] == feed.cursor(feed.last_seq)
+
+    future_cursor = feed.cursor(feed.last_seq + 100)
+    response = client.get("/tasks/changes", params={"since": future_cursor})
+    assert response.json()["resync"] is True
+
+
+def test_cursor_from_restarted_feed_resyncs():
+    old_feed = ChangeFeed(max_events=100)
+    for task_id in range(5):
+        old_feed.publish("deleted", task_id)
+    cursor = old_feed.cursor(old_feed.last_seq)
+
+    restarted_feed = ChangeFeed(max_events=100)  # same numbers, different events
+    for task_id in range(10):
+        restarted_feed.publish("deleted", task_id)
+    changes = restarted_feed.since(cursor)
+    assert changes.resync is True
+    assert changes.events == []
+    assert restarted_feed.since(changes.cursor).resync is False
+    assert restarted_feed.since("5").resync is True  # plain numbers aren't cursors
+
+
+def test_long_poll_wakes_up_on_change():
+    change_feed = ChangeFeed(max_events=2)
+
+    async def wait_and_publish():
+        async with anyio.create_task_group() as task_group:
+            task_group.start_soon(
+                anyio.to_thread.run_sync, change_feed.publish, "deleted", 7
+            )
+            changes = await change_feed.wait(change_feed.cursor(0), timeout=5)
+        return changes
+
+    changes = anyio.run(wait_and_publish)
+    assert [event.task_id for event in changes.events] == [7]
+
+    for task_id in range(3):
+        change_feed.publish("deleted", task_id)
+    assert change_feed.since(change_feed.cursor(0)).resync  # event 1 fell out
+    changes = change_feed.since(change_feed.cursor(2))
+    assert [event.seq for event in changes.events] == [3, 4]
+
+
+def test_server_sent_events():
+    change_feed = ChangeFeed(max_events=10)
+    change_feed.publish("deleted", 3)
+
+    async def first_messages():
+        stream = server_sent_events(change_feed, change_feed.cursor(0), heartbeat=0.01)
+        messages = [await stream.__anext__() for _ in range(2)]
+        await stream.aclose()
+        return messages
+
+    change, keep_alive = anyio.run(first_messages)
+    assert change.startswith(f"id: {change_feed.epoch}:1\nevent: change\ndata: ")
+    assert keep_alive == ": keep-alive\n\n"
+
+    async def first_message(cursor):
+        stream = server_sent_events(change_feed, cursor, heartbeat=0.01)
+        message = await stream.__anext__()
+        await stream.aclose()
+        return message
+
+    resync = anyio.run(first_message, "other-process:1")
+    assert resync.startswith(f"id: {change_feed.epoch}:1\nevent: resync\n")
+
+
+from store import TaskTable
+
+
+def test_task_table_many_distinct_statuses():
+    table = TaskTable()
+    for number in range(70_000):  # more than a 16 bit status code can tell apart
+        table.append(number, "title", "", f"Status {number}")
+    assert table.status(69_999) == "Status 69999"
+
+    with pytest.raises(TypeError):
+        table.append("not an id", "title", "", "Ready")
+    assert len(table.titles) == len(table.descriptions) == len(table) == 70_000
+    assert len(table.status_codes) == 70_000
+
+    response = client.post(
+        "/task", json={"title": "New", "description": "", "status": "Status 70000"}
+    )
+    assert response.status_code == 200
+
+
+def test_task_table_lookup_by_id():
+    table = TaskTable()
+    for id in (1, 2, 5, 9):
+        table.append(id, f"Task {id}", "", "Ready")
+    assert table.ascending
+    assert [table.index(id) for id in (1, 5, 9, 3, 10)] == [0, 2, 3, None, None]
+    assert table.next_id() == 10
+    assert table.without(3).next_id() == 6
+    assert table.without(0).copy().index(9) == 2
+
+    # a csv edited by hand can have its ids in any order
+    table.append(4, "Task 4", "", "Ready")
+    assert not table.ascending
+    assert [table.index(id) for id in (4, 9, 3)] == [4, 3, None]
+    assert table.without(3).next_id() == 6
+
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import main
+
+
+def slow_filter_tasks(started: threading.Event, release: threading.Event):
+    filter_tasks = main.filter_tasks
+
+    def filter_tasks_slowly(status, title):
+        tasks = filter_tasks(status, title)  # read now, answer later
+        started.set()
+        release.wait(5)
+        return tasks
+
+    return filter_tasks_slowly
+
+
+def test_endpoint_get_tasks_coalesces_identical_reads():
+    started, release = threading.Event(), threading.Event()
+    before = main.task_reads.stats()
+    with patch("main.filter_tasks", slow_filter_tasks(started, release)):
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            first = executor.submit(client.get, "/tasks")
+            started.wait(5)
+            others = [executor.submit(client.get, "/tasks") for _ in range(3)]
+            while main.task_reads.stats()["coalesced"] < before["coalesced"] + 3:
+                time.sleep(0.01)
+            release.set()
+            responses = [first.result()] + [future.result() for future in others]
+    ids = [[task["id"] for task in response.json()] for response in responses]
+    assert ids == [[1, 2]] * 4
+    metrics = client.get("/metrics/single-flight").json()["task_reads"]
+    assert metrics["executed"] == before["executed"] + 1
+    assert metrics["coalesced"] == before["coalesced"] + 3
+
+
+def test_endpoint_get_tasks_after_write_does_not_join_older_read():
+    started, release = threading.Event(), threading.Event()
+    before = main.task_reads.stats()
+    with patch("main.filter_tasks", slow_filter_tasks(started, release)):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            old_read = executor.submit(client.get, "/tasks")
+            started.wait(5)
+            client.put("/task/1", json={"status": "Done"})
+            new_read = executor.submit(client.get, "/tasks")
+            while main.task_reads.stats()["executed"] < before["executed"] + 2:
+                assert main.task_reads.stats()["coalesced"] == before["coalesced"]
+                time.sleep(0.01)
+            release.set()
+            assert old_read.result().json()[0]["status"] == "Incomplete"
+            assert new_read.result().json()[0]["status"] == "Done"
+    assert main.task_reads.stats()["coalesced"] == before["coalesced"]
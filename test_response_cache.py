@@ -0,0 +1,129 @@
+import asyncio
+
+import httpx
+from fastapi import APIRouter, FastAPI, Response
+from fastapi.testclient import TestClient
+
+from response_cache import ResponseCache
+
+
+def make_app(cache: ResponseCache):
+    app = FastAPI()
+    router = APIRouter(route_class=cache.route_class())
+    calls = {"count": 0}
+
+    @router.get("/items/{item_id}")
+    async def read_item(item_id: int, q: str | None = None, page: int = 1):
+        calls["count"] += 1
+        await asyncio.sleep(0.05)
+        return {"item_id": item_id, "q": q, "page": page, "call": calls["count"]}
+
+    @router.get("/missing")
+    async def read_missing():
+        calls["count"] += 1
+        return Response(status_code=404)
+
+    app.include_router(router)
+    return app, calls
+
+
+def test_cache_hits_and_keys():
+    cache = ResponseCache(ttl=60, vary_query=["q"], vary_headers=["Accept-Language"])
+    app, calls = make_app(cache)
+    client = TestClient(app)
+
+    first = client.get("/items/1", params={"q": "a"})
+    assert first.headers["x-cache"] == "MISS"
+    second = client.get(
+        "/items/1", params={"q": "a", "page": 2}
+    )  # page is not part of the key
+    assert second.headers["x-cache"] == "HIT"
+    assert second.json() == first.json()
+    assert second.headers["vary"] == "accept-language"
+
+    assert client.get("/items/1", params={"q": "b"}).headers["x-cache"] == "MISS"
+    response = client.get(
+        "/items/1", params={"q": "a"}, headers={"Accept-Language": "de"}
+    )
+    assert response.headers["x-cache"] == "MISS"
+    assert calls["count"] == 3
+
+    client.get("/missing")
+    client.get("/missing")
+    assert calls["count"] == 5  # error responses are not cached
+    stats = cache.stats()
+    assert (stats["hits"], stats["entries"]) == (1, 3)
+
+
+def test_cache_eviction():
+    cache = ResponseCache(ttl=60, max_entries=2)
+    app, calls = make_app(cache)
+    client = TestClient(app)
+    for item_id in (1, 2, 1, 3):  # 1 is used again, so 2 is the least recently used
+        client.get(f"/items/{item_id}")
+    assert client.get("/items/1").headers["x-cache"] == "HIT"
+    assert client.get("/items/2").headers["x-cache"] == "MISS"
+    assert cache.stats()["evictions"] == 2
+
+    cache = ResponseCache(ttl=60, max_bytes=400)
+    app, calls = make_app(cache)
+    client = TestClient(app)
+    for item_id in range(10):
+        client.get(f"/items/{item_id}")
+    assert cache.stats()["bytes"] <= 400
+    assert cache.stats()["entries"] < 10
+
+
+def test_cache_stale_while_revalidate():
+    cache = ResponseCache(ttl=0, stale_ttl=60)
+    app, calls = make_app(cache)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as client:
+            first = await client.get("/items/1")
+            stale = await client.get("/items/1")
+            assert stale.headers["x-cache"] == "STALE"
+            assert stale.json() == first.json()
+            assert len(cache._refresh_tasks) == 1  # kept alive until it is done
+            await asyncio.sleep(0.2)  # background refresh finishes
+            assert not cache._refresh_tasks
+            refreshed = await client.get("/items/1")
+            assert refreshed.json()["call"] == 2
+
+    asyncio.run(scenario())
+    assert cache.stats()["stale_hits"] == 2
+
+
+def test_cache_coalesces_concurrent_misses():
+    cache = ResponseCache(ttl=60)
+    app, calls = make_app(cache)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as client:
+            responses = await asyncio.gather(
+                *(client.get("/items/7") for _ in range(20))
+            )
+        assert {response.json()["call"] for response in responses} == {1}
+
+    asyncio.run(scenario())
+    assert calls["count"] == 1
+    assert cache.stats()["coalesced"] == 19
+
+
+def test_root_app_cache():
+    from main import app
+
+    client = TestClient(app)
+    client.get("/")
+    client.get("/")
+    client.get("/items/5")
+    client.get("/items/5")
+    stats = client.get("/cache/stats").json()
+    assert stats["root"]["hits"] >= 1
+    assert stats["items"]["hits"] >= 1
@@ -0,0 +1,111 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from single_flight import SingleFlight, coalesced, single_flight_metrics_router
+
+
+def test_do_sync_coalesces_concurrent_calls():
+    flight = SingleFlight("test")
+    calls = []
+
+    def load(key):
+        calls.append(key)
+        time.sleep(0.1)
+        return {"key": key}
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        futures = [executor.submit(flight.do_sync, "a", load, "a") for _ in range(8)]
+        other = executor.submit(flight.do_sync, "b", load, "b")
+        results = [future.result() for future in futures]
+
+    assert calls.count("a") == 1
+    assert all(result is results[0] for result in results)
+    assert other.result() == {"key": "b"}
+    assert flight.stats()["executed"] == 2
+    assert flight.stats()["coalesced"] == 7
+
+    flight.do_sync("a", load, "a")  # nothing is cached once the call is finished
+    assert calls.count("a") == 2
+
+
+def test_do_sync_shares_errors():
+    flight = SingleFlight("test")
+    started = threading.Event()
+
+    def fail():
+        started.set()
+        time.sleep(0.1)
+        raise ValueError("broken")
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        leader = executor.submit(flight.do_sync, "key", fail)
+        started.wait()
+        follower = executor.submit(flight.do_sync, "key", fail)
+        for future in (leader, follower):
+            with pytest.raises(ValueError):
+                future.result()
+    assert flight.stats()["errors"] == 1
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_do_survives_cancelled_caller():
+    flight = SingleFlight("test")
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def main():
+        first = asyncio.ensure_future(flight.do("key", load))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(flight.do("key", load))
+        await asyncio.sleep(0)
+        first.cancel()  # the client of the first request went away
+        return await second
+
+    assert asyncio.run(main()) == "result"
+    assert calls == [1]
+    assert flight.stats()["coalesced"] == 1
+
+
+def test_coalesced_endpoints():
+    flight = SingleFlight("reads")
+    app = FastAPI()
+    app.include_router(single_flight_metrics_router(flight))
+    calls = {"sync": 0, "async": 0}
+
+    @app.get("/sync")
+    @coalesced(flight)
+    def read_sync(q: str):
+        calls["sync"] += 1
+        time.sleep(0.1)
+        return {"q": q}
+
+    @app.get("/async")
+    @coalesced(flight)
+    async def read_async(q: str):
+        calls["async"] += 1
+        await asyncio.sleep(0.1)
+        return {"q": q}
+
+    with TestClient(app) as client:
+        for path in ("/sync", "/async"):
+            with ThreadPoolExecutor(max_workers=5) as executor:
+                responses = list(
+                    executor.map(
+                        lambda _: client.get(path, params={"q": "x"}), range(5)
+                    )
+                )
+            assert [response.json() for response in responses] == [{"q": "x"}] * 5
+        metrics = client.get("/metrics/single-flight").json()
+
+    assert calls["sync"] < 5 and calls["async"] < 5
+    assert metrics["reads"]["coalesced"] == 10 - calls["sync"] - calls["async"]
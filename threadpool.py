@@ -0,0 +1,121 @@
+# Threadpool sizing and metrics for sync endpoints, shared by the apps in this repo.
+#
+# FastAPI runs every `def` endpoint (and sync dependency) on AnyIO's default thread limiter, 40 threads
+# for the whole process. When they are all busy, new requests wait for a thread and nothing shows it.
+# This module lets an app
+#   - set the capacity of the default limiter (threadpool_lifespan)
+#   - run groups of routes on their own limiter, e.g. one for blocking I/O and one for CPU work,
+#     so one kind of slow route can't take every thread (ThreadpoolGroup + run_in)
+#   - expose busy threads, queue depth and wait times (threadpool_metrics_router)
+#
+# The apps live in their own folders and add the repo root to sys.path to import it.
+
+import functools
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+
+import anyio
+import anyio.to_thread
+from fastapi import APIRouter
+
+
+def env_capacity(name: str, default: int) -> int:
+    return int(os.getenv(name, str(default)))
+
+
+class ThreadpoolGroup:
+    def __init__(self, name: str, capacity: int):
+        self.name = name
+        self.limiter = anyio.CapacityLimiter(capacity)
+        self.calls = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_run = 0.0
+        self._lock = (
+            threading.Lock()
+        )  # the timings are recorded from the worker threads
+
+    async def run(self, function, *args, **kwargs):
+        queued = time.perf_counter()
+        started = None
+
+        def call():
+            nonlocal started
+            started = time.perf_counter()
+            return function(*args, **kwargs)
+
+        try:
+            return await anyio.to_thread.run_sync(call, limiter=self.limiter)
+        finally:
+            finished = time.perf_counter()
+            if started is not None:
+                self.record(started - queued, finished - started)
+
+    def record(self, wait: float, run: float):
+        with self._lock:
+            self.calls += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self.total_run += run
+
+    def stats(self) -> dict:
+        statistics = self.limiter.statistics()
+        with self._lock:
+            calls = self.calls or 1
+            return {
+                "capacity": statistics.total_tokens,
+                "busy": statistics.borrowed_tokens,
+                "queued": statistics.tasks_waiting,
+                "calls": self.calls,
+                "avg_wait_ms": round(self.total_wait / calls * 1000, 3),
+                "max_wait_ms": round(self.max_wait * 1000, 3),
+                "avg_run_ms": round(self.total_run / calls * 1000, 3),
+            }
+
+
+def run_in(group: ThreadpoolGroup):
+    # Decorator for a sync endpoint: put it under @app.get(...) and the function runs on the group's
+    # limiter instead of the default one. functools.wraps keeps the signature, so FastAPI still sees
+    # the same parameters and dependencies.
+    def decorator(function):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            return await group.run(function, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def default_threadpool_stats() -> dict:
+    statistics = anyio.to_thread.current_default_thread_limiter().statistics()
+    return {
+        "capacity": statistics.total_tokens,
+        "busy": statistics.borrowed_tokens,
+        "queued": statistics.tasks_waiting,
+    }
+
+
+def threadpool_lifespan(capacity: int):
+    # the default limiter belongs to the event loop, so its capacity can only be set once the loop runs
+    @asynccontextmanager
+    async def lifespan(app):
+        anyio.to_thread.current_default_thread_limiter().total_tokens = capacity
+        yield
+
+    return lifespan
+
+
+def threadpool_metrics_router(*groups: ThreadpoolGroup) -> APIRouter:
+    router = APIRouter()
+
+    @router.get("/metrics/threadpool")
+    async def read_threadpool_metrics():
+        return {
+            "default": default_threadpool_stats(),
+            **{group.name: group.stats() for group in groups},
+        }
+
+    return router
@@ -0,0 +1,10 @@
+import pytest
+from unittest.mock import patch
+
+
+@pytest.fixture(
+    autouse=True
+)  # every test writes its uploads into its own temporary directory
+def upload_directory(tmp_path):
+    with patch("streaming.UPLOAD_DIRECTORY", tmp_path) as directory:
+        yield directory
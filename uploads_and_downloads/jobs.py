@@ -0,0 +1,113 @@
+import gzip
+import hashlib
+import os
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from pydantic import BaseModel
+
+import streaming
+
+# Work that is not needed to answer the upload request (checksums, size stats, compression) is queued
+# here and done by a small pool of worker threads. hashlib and zlib release the GIL on large buffers,
+# so the workers really run in parallel. The client polls GET /jobs/{job_id} for the results.
+
+POSTPROCESS_WORKERS = int(os.getenv("POSTPROCESS_WORKERS", "4"))
+MAX_TRACKED_JOBS = 1000  # oldest finished jobs are forgotten after this
+
+postprocess_executor = ThreadPoolExecutor(
+    max_workers=POSTPROCESS_WORKERS, thread_name_prefix="postprocess"
+)
+
+
+class FileReport(BaseModel):
+    filename: str
+    status: str = "pending"  # pending, done or failed
+    size: int | None = None
+    sha256: str | None = None
+    compressed_filename: str | None = None
+    compressed_size: int | None = None
+    error: str | None = None
+
+
+class Job(BaseModel):
+    id: str
+    status: str = "queued"  # queued, running, done or failed
+    files: list[FileReport]
+
+
+jobs: OrderedDict[str, Job] = OrderedDict()
+jobs_lock = threading.Lock()
+
+
+def derived_directory(job_id: str) -> Path:
+    # files made by a job go to their own hidden folder, so they can never replace an uploaded file
+    # (an upload called "a.txt.gz" next to "a.txt") or a file another job is still reading
+    return streaming.UPLOAD_DIRECTORY / ".derived" / job_id
+
+
+def postprocess_file(path: Path, compress: bool, job_id: str) -> dict:
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as file:
+        while data := file.read(streaming.CHUNK_SIZE):
+            digest.update(data)
+            size += len(data)
+    result = {"size": size, "sha256": digest.hexdigest()}
+    if compress:
+        directory = derived_directory(job_id)
+        directory.mkdir(parents=True, exist_ok=True)
+        compressed_path = directory / (path.name + ".gz")
+        temporary_path = directory / f".{path.name}.gz.{uuid.uuid4().hex}.part"
+        try:
+            with open(path, "rb") as source, gzip.open(temporary_path, "wb") as target:
+                shutil.copyfileobj(source, target, streaming.CHUNK_SIZE)
+            os.replace(temporary_path, compressed_path)
+        except BaseException:
+            temporary_path.unlink(missing_ok=True)
+            raise
+        # relative to the upload directory
+        result["compressed_filename"] = str(
+            compressed_path.relative_to(streaming.UPLOAD_DIRECTORY)
+        )
+        result["compressed_size"] = compressed_path.stat().st_size
+    return result
+
+
+def run_file(job: Job, index: int, path: Path, compress: bool):
+    try:
+        with jobs_lock:
+            job.status = "running"
+        update = {**postprocess_file(path, compress, job.id), "status": "done"}
+    except Exception as exc:
+        update = {"status": "failed", "error": str(exc)}
+    with jobs_lock:
+        job.files[index] = job.files[index].model_copy(update=update)
+        if all(report.status != "pending" for report in job.files):
+            failed = any(report.status == "failed" for report in job.files)
+            job.status = "failed" if failed else "done"
+
+
+def submit_job(paths: list[Path], compress: bool = False) -> Job:
+    job = Job(
+        id=uuid.uuid4().hex,
+        files=[FileReport(filename=path.name) for path in paths],
+    )
+    with jobs_lock:
+        jobs[job.id] = job
+        while len(jobs) > MAX_TRACKED_JOBS:
+            jobs.popitem(last=False)
+    # one task per file, so the files of a job are processed in parallel too
+    for index, path in enumerate(paths):
+        postprocess_executor.submit(run_file, job, index, path, compress)
+    return job
+
+
+def get_job(job_id: str) -> Job | None:
+    with jobs_lock:
+        job = jobs.get(job_id)
+        return job.model_copy(deep=True) if job else None
@@ -1,14 +1,227 @@
-import shutil
-from fastapi import FastAPI, File, UploadFile
+import hashlib
+import os
+import stat
 
-# shutil - used to efficiently copy file objects
-File.Uo
+import anyio
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import FileResponse
+
+from streaming import (
+    ChunkedFileWriter,
+    MultipartStream,
+    check_content_length,
+    part_filename,
+    sanitize_filename,
+)
+import streaming
+import sessions
+import jobs
 
 app = FastAPI()
+app.include_router(sessions.router)
+
+# The endpoint reads the raw request, so the form is described by hand for the swagger docs
+UPLOAD_FILE_FORM = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                    "required": ["file"],
+                }
+            }
+        },
+    }
+}
+
+
+@app.post("/uploadfile", openapi_extra=UPLOAD_FILE_FORM)
+async def upload_file(request: Request):
+    # Instead of `file: UploadFile` (starlette would first spool the whole body into a temporary file and we
+    # would copy it a second time) the body is parsed while it arrives and the file part goes straight to disk.
+    check_content_length(request)  # reject too big uploads before reading a single byte
+    filename = size = None
+    writer = None
+    try:
+        async for event, value in MultipartStream(request):
+            if event == "begin":
+                name, original_filename = part_filename(value)
+                if (
+                    name == "file"
+                    and original_filename is not None
+                    and filename is None
+                ):
+                    filename = sanitize_filename(original_filename)
+                    writer = await ChunkedFileWriter(
+                        streaming.UPLOAD_DIRECTORY / filename
+                    ).open()
+            elif event == "data" and writer is not None:
+                await writer.write(value)
+            elif event == "end" and writer is not None:
+                size = await writer.commit()
+                writer = None
+    finally:
+        if writer is not None:
+            await writer.abort()
+    if filename is None or size is None:
+        raise HTTPException(status_code=400, detail="No file uploaded")
+    return {"filename": filename, "size": size}
+
+
+# how many files of one multi-file upload may be open for writing at the same time
+MAX_PARALLEL_WRITES = int(os.getenv("MAX_PARALLEL_WRITES", "4"))
+MAX_FILES_PER_UPLOAD = int(os.getenv("MAX_FILES_PER_UPLOAD", "100"))
+
+UPLOAD_FILES_FORM = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "files": {
+                            "type": "array",
+                            "items": {"type": "string", "format": "binary"},
+                        }
+                    },
+                    "required": ["files"],
+                }
+            }
+        },
+    }
+}
+
+
+async def write_part(path, receive_stream, write_slots, sizes: dict):
+    # one task per file: drains the chunks the parser sends and writes them, holding a write slot
+    try:
+        writer = await ChunkedFileWriter(path).open()
+        try:
+            async with receive_stream:
+                async for data in receive_stream:
+                    await writer.write(data)
+            sizes[path.name] = await writer.commit()
+        except BaseException:
+            await writer.abort()
+            raise
+    finally:
+        write_slots.release()
+
+
+@app.post("/uploadfiles", openapi_extra=UPLOAD_FILES_FORM)
+async def upload_files(request: Request, compress: bool = False):
+    # The body of a request arrives in order, but each file gets its own writer task: while the parser
+    # is already reading the next file, the previous ones are still being flushed to disk by worker
+    # threads. At most MAX_PARALLEL_WRITES files are open at once, after that the parser waits.
+    # Checksums, size stats and compression run afterwards in the background, see jobs.py.
+    check_content_length(request)
+    filenames = []
+    sizes = {}
+    write_slots = anyio.Semaphore(MAX_PARALLEL_WRITES)
+    error = None
+    async with anyio.create_task_group() as task_group:
+        try:
+            send_stream = None
+            async for event, value in MultipartStream(request):
+                if event == "begin":
+                    name, original_filename = part_filename(value)
+                    if name != "files" or original_filename is None:
+                        continue
+                    filename = sanitize_filename(original_filename)
+                    if filename in filenames:
+                        raise HTTPException(
+                            status_code=400, detail=f"Duplicate file {filename}"
+                        )
+                    if len(filenames) == MAX_FILES_PER_UPLOAD:
+                        raise HTTPException(status_code=400, detail="Too many files")
+                    filenames.append(filename)
+                    await write_slots.acquire()
+                    send_stream, receive_stream = anyio.create_memory_object_stream(4)
+                    task_group.start_soon(
+                        write_part,
+                        streaming.UPLOAD_DIRECTORY / filename,
+                        receive_stream,
+                        write_slots,
+                        sizes,
+                    )
+                elif event == "data" and send_stream is not None:
+                    await send_stream.send(bytes(value))
+                elif event == "end" and send_stream is not None:
+                    await send_stream.aclose()
+                    send_stream = None
+            if send_stream is not None:
+                # the body stopped in the middle of a file, before its closing boundary
+                raise HTTPException(status_code=400, detail="Incomplete multipart body")
+        except HTTPException as exc:
+            # raised inside the task group it would come out wrapped in an ExceptionGroup,
+            # so stop the writers (they remove their partial files) and raise it afterwards.
+            # The writers are cancelled first: a closed stream alone would commit the open file.
+            error = exc
+            task_group.cancel_scope.cancel()
+            if send_stream is not None:
+                send_stream.close()
+    if error is not None:
+        raise error
+    if not filenames:
+        raise HTTPException(status_code=400, detail="No file uploaded")
+    job = jobs.submit_job(
+        [streaming.UPLOAD_DIRECTORY / filename for filename in filenames], compress
+    )
+    return {
+        "job_id": job.id,
+        "files": [{"filename": name, "size": sizes[name]} for name in filenames],
+    }
+
+
+@app.get("/jobs/{job_id}", response_model=jobs.Job)
+async def read_job(job_id: str):
+    job = jobs.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+def file_etag(stat_result: os.stat_result) -> str:
+    # same value FileResponse puts in the ETag header: changes whenever the file is rewritten
+    etag_base = f"{stat_result.st_mtime}-{stat_result.st_size}"
+    return f'"{hashlib.md5(etag_base.encode(), usedforsecurity=False).hexdigest()}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return etag in [candidate.removeprefix("W/") for candidate in candidates]
+
+
+@app.api_route("/downloadfile/{filename}", methods=["GET", "HEAD"])
+async def download_file(filename: str, request: Request):
+    if sanitize_filename(filename) != filename:
+        raise HTTPException(status_code=404, detail="File not found")
+    path = streaming.UPLOAD_DIRECTORY / filename
+    try:
+        stat_result = await anyio.to_thread.run_sync(os.stat, path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+    if not stat.S_ISREG(stat_result.st_mode):
+        raise HTTPException(status_code=404, detail="File not found")
 
+    etag = file_etag(stat_result)
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, etag):
+        # the client already has this exact version
+        return Response(status_code=304, headers={"etag": etag})
 
-@app.post("/uploadfile")
-async def upload_file(file: UploadFile = File(...)):
-    with open(f"uploads/{file.filename}", "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    return {"filename": file.filename}
+    # FileResponse answers Range requests (206 with one range, multipart/byteranges with several,
+    # 416 when the range is outside the file) and honours If-Range. When the server supports the
+    # "http.response.pathsend" ASGI extension it hands the path to the server, which can send it with
+    # sendfile() without copying the data through python. Otherwise the file is read in 64KB blocks.
+    return FileResponse(
+        path,
+        filename=filename,
+        stat_result=stat_result,
+        headers={"etag": etag, "cache-control": "no-cache"},
+    )
@@ -0,0 +1,353 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import secrets
+import shutil
+import uuid
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Annotated
+
+import anyio
+from fastapi import APIRouter, HTTPException, Path as PathParameter, Request
+from pydantic import BaseModel, Field
+
+import streaming
+from streaming import ChunkedFileWriter, iter_request_body, sanitize_filename
+
+# Resumable uploads: the client creates a session, PUTs the file in numbered chunks (each chunk can be
+# retried on its own) and commits. The committed content is stored once per sha256 under .blobs and
+# the file in the upload directory is a hard link to its blob, so uploading the same content again only
+# costs a link. Sessions and blobs live in hidden directories that the download endpoint never serves.
+# A sha256 declared up front is only a hint: knowing a hash doesn't prove having the content. When
+# the content is already stored the session carries a challenge, random byte ranges of it, and the
+# client can skip the upload by proving it has those bytes (POST .../proof). Otherwise it uploads the
+# chunks as usual.
+
+router = APIRouter(prefix="/upload-sessions", tags=["upload sessions"])
+
+MAX_CHUNK_SIZE = int(os.getenv("MAX_UPLOAD_CHUNK_SIZE", str(64 * 1024 * 1024)))
+
+SESSION_ID = re.compile(r"^[0-9a-f]{32}$")
+SHA256 = re.compile(r"^[0-9a-f]{64}$")
+
+CHALLENGE_RANGES = 4
+CHALLENGE_RANGE_SIZE = 4096
+
+# session id -> (lock, number of commits holding or waiting for it), the entry goes away with the last one
+session_locks: dict[str, tuple[asyncio.Lock, int]] = {}
+
+
+@asynccontextmanager
+async def session_lock(session_id: str):
+    lock, users = session_locks.get(session_id, (None, 0))
+    lock = lock or asyncio.Lock()
+    session_locks[session_id] = (lock, users + 1)
+    try:
+        async with lock:
+            yield
+    finally:
+        lock, users = session_locks[session_id]
+        if users == 1:
+            del session_locks[session_id]
+        else:
+            session_locks[session_id] = (lock, users - 1)
+
+
+def sessions_directory() -> Path:
+    return streaming.UPLOAD_DIRECTORY / ".sessions"
+
+
+def blob_path(sha256: str) -> Path:
+    # two levels so no single directory ends up with millions of entries
+    return streaming.UPLOAD_DIRECTORY / ".blobs" / sha256[:2] / sha256
+
+
+class UploadSessionCreate(BaseModel):
+    filename: str
+    size: int | None = Field(None, ge=0)
+    sha256: str | None = Field(
+        None, pattern=SHA256.pattern
+    )  # lets the server skip known content
+
+
+class Challenge(BaseModel):
+    # proof = sha256(bytes.fromhex(nonce) + content[start : start + length]) for every range, in order
+    nonce: str
+    ranges: list[tuple[int, int]]  # (start, length)
+
+
+class UploadSession(BaseModel):
+    id: str | None
+    filename: str
+    status: str  # "open" or "completed"
+    received_chunks: list[int] = []
+    received_bytes: int = 0
+    next_chunk: int = (
+        0  # first chunk the server does not have yet, where an interrupted upload resumes
+    )
+    sha256: str | None = None
+    deduplicated: bool = False
+    # set when the declared sha256 is known: answer it to skip the upload
+    challenge: Challenge | None = None
+
+
+class Proof(BaseModel):
+    hashes: list[Annotated[str, Field(pattern=SHA256.pattern)]]
+
+
+def new_challenge(size: int) -> dict:
+    length = min(CHALLENGE_RANGE_SIZE, size)
+    return {
+        "nonce": secrets.token_hex(16),
+        "ranges": [
+            (secrets.randbelow(size - length + 1), length)
+            for _ in range(CHALLENGE_RANGES)
+        ],
+    }
+
+
+def challenge_answer(blob: Path, challenge: dict) -> list[str]:
+    nonce = bytes.fromhex(challenge["nonce"])
+    hashes = []
+    with open(blob, "rb") as file:
+        for start, length in challenge["ranges"]:
+            file.seek(start)
+            hashes.append(hashlib.sha256(nonce + file.read(length)).hexdigest())
+    return hashes
+
+
+def link_blob(blob: Path, destination: Path):
+    # a hard link shares the blob's data, the temporary name + replace keeps the swap atomic
+    temporary_path = destination.with_name(
+        f".{destination.name}.{uuid.uuid4().hex}.link"
+    )
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(blob, temporary_path)
+    except OSError:  # file system without hard links
+        shutil.copyfile(blob, temporary_path)
+    os.replace(temporary_path, destination)
+
+
+def load_session(session_id: str) -> dict:
+    if not SESSION_ID.match(session_id):
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    try:
+        return json.loads(
+            (sessions_directory() / session_id / "session.json").read_text()
+        )
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+
+
+def received_chunks(session_id: str) -> dict[int, int]:
+    # chunk files only appear once they are complete (they are renamed into place), so the directory
+    # listing is the state of the session: chunk number -> size
+    chunks_directory = sessions_directory() / session_id / "chunks"
+    try:
+        entries = list(os.scandir(chunks_directory))
+    except FileNotFoundError:  # committed in the meantime
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    return {
+        int(entry.name): entry.stat().st_size
+        for entry in entries
+        if entry.name.isdigit()
+    }
+
+
+def session_status(session: dict) -> UploadSession:
+    chunks = received_chunks(session["id"])
+    next_chunk = 0
+    while next_chunk in chunks:
+        next_chunk += 1
+    return UploadSession(
+        id=session["id"],
+        filename=session["filename"],
+        status="open",
+        received_chunks=sorted(chunks),
+        received_bytes=sum(chunks.values()),
+        next_chunk=next_chunk,
+        sha256=session["sha256"],
+        challenge=session.get("challenge"),
+    )
+
+
+def assemble_blob(session: dict, chunk_numbers: list[int]) -> tuple[str, int, bool]:
+    # Copies the chunks in order into a temporary file and hashes them on the way, in one pass.
+    # Runs in a worker thread. Returns the sha256, the size and whether the blob already existed.
+    session_directory = sessions_directory() / session["id"]
+    temporary_path = session_directory / "assembled.part"
+    digest = hashlib.sha256()
+    size = 0
+    with open(temporary_path, "wb") as assembled:
+        for number in chunk_numbers:
+            with open(session_directory / "chunks" / str(number), "rb") as chunk:
+                while data := chunk.read(streaming.CHUNK_SIZE):
+                    digest.update(data)
+                    assembled.write(data)
+                    size += len(data)
+    sha256 = digest.hexdigest()
+    if session["sha256"] and session["sha256"] != sha256:
+        temporary_path.unlink()
+        raise HTTPException(status_code=422, detail="Content does not match sha256")
+    blob = blob_path(sha256)
+    if blob.exists():
+        temporary_path.unlink()
+        return sha256, size, True
+    blob.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(temporary_path, blob)
+    return sha256, size, False
+
+
+@router.post("", response_model=UploadSession)
+async def create_upload_session(upload: UploadSessionCreate):
+    filename = sanitize_filename(upload.filename)
+    if upload.size is not None and upload.size > streaming.MAX_UPLOAD_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Upload larger than {streaming.MAX_UPLOAD_SIZE} bytes",
+        )
+    session = {
+        "id": uuid.uuid4().hex,
+        "filename": filename,
+        "size": upload.size,
+        "sha256": upload.sha256,
+        "challenge": None,
+    }
+    if upload.sha256:
+        try:
+            blob_size = (
+                await anyio.to_thread.run_sync(os.stat, blob_path(upload.sha256))
+            ).st_size
+        except FileNotFoundError:
+            blob_size = None
+        if blob_size is not None and upload.size in (None, blob_size):
+            session["challenge"] = new_challenge(blob_size)
+
+    def create_session_directory():
+        (sessions_directory() / session["id"] / "chunks").mkdir(parents=True)
+        write_session(session)
+
+    await anyio.to_thread.run_sync(create_session_directory)
+    return await anyio.to_thread.run_sync(session_status, session)
+
+
+@router.get("/{session_id}", response_model=UploadSession)
+async def read_upload_session(session_id: str):
+    session = await anyio.to_thread.run_sync(load_session, session_id)
+    return await anyio.to_thread.run_sync(session_status, session)
+
+
+def write_session(session: dict):
+    (sessions_directory() / session["id"] / "session.json").write_text(
+        json.dumps(session)
+    )
+
+
+@router.post("/{session_id}/proof", response_model=UploadSession)
+async def prove_upload_session(session_id: str, proof: Proof):
+    # the client shows it has the content of the known blob, which is then linked without an upload
+    async with session_lock(session_id):
+        session = await anyio.to_thread.run_sync(load_session, session_id)
+        challenge = session.get("challenge")
+        if challenge is None:
+            raise HTTPException(
+                status_code=409, detail="No challenge, upload the chunks"
+            )
+        blob = blob_path(session["sha256"])
+        answer = await anyio.to_thread.run_sync(challenge_answer, blob, challenge)
+        if len(proof.hashes) != len(answer) or not secrets.compare_digest(
+            "".join(proof.hashes), "".join(answer)
+        ):
+            # one attempt per challenge, after that only the chunks count
+            session["challenge"] = None
+            await anyio.to_thread.run_sync(write_session, session)
+            raise HTTPException(status_code=422, detail="Proof does not match")
+        await anyio.to_thread.run_sync(
+            link_blob, blob, streaming.UPLOAD_DIRECTORY / session["filename"]
+        )
+        await anyio.to_thread.run_sync(
+            shutil.rmtree, sessions_directory() / session["id"]
+        )
+    return UploadSession(
+        id=session["id"],
+        filename=session["filename"],
+        status="completed",
+        received_bytes=(await anyio.to_thread.run_sync(os.stat, blob)).st_size,
+        sha256=session["sha256"],
+        deduplicated=True,
+    )
+
+
+@router.put("/{session_id}/chunks/{chunk_number}")
+async def upload_chunk(
+    session_id: str, request: Request, chunk_number: int = PathParameter(..., ge=0)
+):
+    session = await anyio.to_thread.run_sync(load_session, session_id)
+    # all chunks together may not be larger than a plain upload, a retried chunk doesn't count twice
+    chunks = await anyio.to_thread.run_sync(received_chunks, session["id"])
+    received_bytes = sum(chunks.values()) - chunks.get(chunk_number, 0)
+    max_size = min(MAX_CHUNK_SIZE, streaming.MAX_UPLOAD_SIZE - received_bytes)
+    streaming.check_content_length(request, max_size)
+    chunk_path = sessions_directory() / session["id"] / "chunks" / str(chunk_number)
+    # a retried chunk simply replaces the previous attempt
+    writer = await ChunkedFileWriter(chunk_path).open()
+    digest = hashlib.sha256()
+    try:
+        async for data in iter_request_body(request, max_size):
+            digest.update(data)
+            await writer.write(data)
+        expected = request.headers.get("x-chunk-sha256")
+        if expected and expected.lower() != digest.hexdigest():
+            raise HTTPException(status_code=422, detail="Chunk does not match sha256")
+        size = await writer.commit()
+    except BaseException:
+        await writer.abort()
+        raise
+    return {"chunk": chunk_number, "size": size, "sha256": digest.hexdigest()}
+
+
+@router.post("/{session_id}/commit", response_model=UploadSession)
+async def commit_upload_session(session_id: str):
+    session = await anyio.to_thread.run_sync(load_session, session_id)
+    async with session_lock(session_id):
+        return await commit_session(session)
+
+
+async def commit_session(session: dict) -> UploadSession:
+    status = await anyio.to_thread.run_sync(session_status, session)
+    if not status.received_chunks or status.next_chunk != len(status.received_chunks):
+        raise HTTPException(
+            status_code=409,
+            detail=f"Missing chunks, upload resumes at chunk {status.next_chunk}",
+        )
+    if session["size"] is not None and status.received_bytes != session["size"]:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Received {status.received_bytes} of {session['size']} bytes",
+        )
+    if status.received_bytes > streaming.MAX_UPLOAD_SIZE:  # chunks uploaded in parallel
+        raise HTTPException(
+            status_code=413,
+            detail=f"Upload larger than {streaming.MAX_UPLOAD_SIZE} bytes",
+        )
+    sha256, size, deduplicated = await anyio.to_thread.run_sync(
+        assemble_blob, session, status.received_chunks
+    )
+    await anyio.to_thread.run_sync(
+        link_blob,
+        blob_path(sha256),
+        streaming.UPLOAD_DIRECTORY / session["filename"],
+    )
+    await anyio.to_thread.run_sync(shutil.rmtree, sessions_directory() / session["id"])
+    return UploadSession(
+        id=session["id"],
+        filename=session["filename"],
+        status="completed",
+        received_bytes=size,
+        sha256=sha256,
+        deduplicated=deduplicated,
+    )
@@ -0,0 +1,179 @@
+import os
+import re
+import uuid
+from pathlib import Path
+
+import anyio
+from fastapi import HTTPException, Request
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+UPLOAD_DIRECTORY = Path("uploads")
+
+# biggest request body we accept, checked against Content-Length before reading anything
+# and against the bytes actually received while streaming
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", str(100 * 1024 * 1024)))
+
+# data is collected in memory until a block of this size is ready, then written from a worker thread
+CHUNK_SIZE = 1024 * 1024
+
+UNSAFE_FILENAME_CHARACTERS = re.compile(r"[^A-Za-z0-9._-]")
+
+
+def sanitize_filename(filename: str | None) -> str:
+    # keeps only the last path component ("../../etc/passwd" -> "passwd") and replaces anything that is
+    # not a letter, digit, dot, dash or underscore. Leading dots are removed so hidden files can't be created.
+    name = re.split(r"[\\/]", filename or "")[-1]
+    name = UNSAFE_FILENAME_CHARACTERS.sub("_", name).lstrip(".")[:255]
+    if not name:
+        raise HTTPException(status_code=400, detail="Invalid filename")
+    return name
+
+
+def check_content_length(request: Request, max_size: int | None = None):
+    max_size = MAX_UPLOAD_SIZE if max_size is None else max_size
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_size:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Upload larger than {max_size} bytes",
+        )
+
+
+async def iter_request_body(request: Request, max_size: int | None = None):
+    # request.stream() hands out the body as the server receives it, nothing is spooled to disk first
+    max_size = MAX_UPLOAD_SIZE if max_size is None else max_size
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > max_size:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Upload larger than {max_size} bytes",
+            )
+        yield chunk
+
+
+class ChunkedFileWriter:
+    # Writes into a temporary file next to the destination and only renames it to the real name in
+    # commit(), so a failed or cancelled upload never leaves a half written file behind.
+    # Every disk operation runs in a worker thread, the event loop only fills the buffer.
+
+    def __init__(self, path: Path, chunk_size: int = CHUNK_SIZE):
+        self.path = path
+        self.temporary_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.part")
+        self.chunk_size = chunk_size
+        self.size = 0
+        self._buffer = bytearray()
+        self._file = None
+
+    async def open(self):
+        await anyio.to_thread.run_sync(
+            lambda: self.path.parent.mkdir(parents=True, exist_ok=True)
+        )
+        self._file = await anyio.open_file(self.temporary_path, "wb")
+        return self
+
+    async def write(self, data: bytes):
+        self.size += len(data)
+        self._buffer += data
+        if len(self._buffer) >= self.chunk_size:
+            await self.flush()
+
+    async def flush(self):
+        if self._buffer:
+            data, self._buffer = bytes(self._buffer), bytearray()
+            await self._file.write(data)
+
+    async def commit(self) -> int:
+        await self.flush()
+        await self._file.aclose()
+        await anyio.to_thread.run_sync(os.replace, self.temporary_path, self.path)
+        return self.size
+
+    async def abort(self):
+        with anyio.CancelScope(shield=True):
+            if self._file is not None:
+                await self._file.aclose()
+            await anyio.to_thread.run_sync(
+                lambda: self.temporary_path.unlink(missing_ok=True)
+            )
+
+
+class MultipartStream:
+    # Feeds the request body into python-multipart's push parser and turns its callbacks into events:
+    #   ("begin", headers)  a new form field starts, headers is a dict with lowercase names
+    #   ("data", bytes)     next piece of the field's content
+    #   ("end", None)       the field is complete
+
+    def __init__(self, request: Request, max_size: int | None = None):
+        content_type, options = parse_options_header(
+            request.headers.get("content-type", "")
+        )
+        if content_type != b"multipart/form-data" or b"boundary" not in options:
+            raise HTTPException(status_code=400, detail="Expected multipart/form-data")
+        self.request = request
+        self.max_size = max_size
+        self._events = []
+        self._header_field = bytearray()
+        self._header_value = bytearray()
+        self._headers = {}
+        self._parser = MultipartParser(
+            options[b"boundary"],
+            callbacks={
+                "on_part_begin": self._on_part_begin,
+                "on_header_field": self._on_header_field,
+                "on_header_value": self._on_header_value,
+                "on_header_end": self._on_header_end,
+                "on_headers_finished": self._on_headers_finished,
+                "on_part_data": self._on_part_data,
+                "on_part_end": self._on_part_end,
+            },
+        )
+
+    def _on_part_begin(self):
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        field = self._header_field.decode("latin-1").lower()
+        self._headers[field] = self._header_value.decode("latin-1")
+        self._header_field.clear()
+        self._header_value.clear()
+
+    def _on_headers_finished(self):
+        self._events.append(("begin", self._headers))
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._events and self._events[-1][0] == "data":
+            self._events[-1][1].extend(data[start:end])
+        else:
+            self._events.append(("data", bytearray(data[start:end])))
+
+    def _on_part_end(self):
+        self._events.append(("end", None))
+
+    async def __aiter__(self):
+        async for chunk in iter_request_body(self.request, self.max_size):
+            try:
+                self._parser.write(chunk)
+            except Exception as exc:
+                raise HTTPException(
+                    status_code=400, detail=f"Invalid multipart body: {exc}"
+                )
+            events, self._events = self._events, []
+            for event in events:
+                yield event
+        self._parser.finalize()
+
+
+def part_filename(headers: dict) -> tuple[str, str | None]:
+    # returns the form field name and the filename from the part's Content-Disposition header
+    _, options = parse_options_header(headers.get("content-disposition", ""))
+    name = options.get(b"name", b"").decode()
+    filename = options.get(b"filename")
+    return name, filename.decode() if filename is not None else None
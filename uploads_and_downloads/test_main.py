@@ -0,0 +1,362 @@
+from main import app
+from fastapi.testclient import TestClient
+
+client = TestClient(app)
+
+from unittest.mock import patch
+
+
+def test_endpoint_upload_file(upload_directory):
+    content = b"0123456789" * 300_000  # a few chunks of data
+    response = client.post(
+        "/uploadfile",
+        files={"file": ("report.txt", content, "text/plain")},
+        data={"comment": "ignored"},
+    )
+    assert response.status_code == 200
+    assert response.json() == {"filename": "report.txt", "size": len(content)}
+    assert (upload_directory / "report.txt").read_bytes() == content
+    assert [path.name for path in upload_directory.iterdir()] == ["report.txt"]
+
+
+def test_endpoint_upload_file_sanitizes_filename(upload_directory):
+    response = client.post(
+        "/uploadfile", files={"file": ("../../.secret file?.txt", b"data")}
+    )
+    assert response.status_code == 200
+    assert response.json()["filename"] == "secret_file_.txt"
+    assert (upload_directory / "secret_file_.txt").read_bytes() == b"data"
+
+    response = client.post("/uploadfile", files={"file": ("..", b"data")})
+    assert response.status_code == 400
+
+
+def test_endpoint_upload_file_too_large(upload_directory):
+    with patch("streaming.MAX_UPLOAD_SIZE", 1000):
+        response = client.post("/uploadfile", files={"file": ("big.bin", b"x" * 2000)})
+    assert response.status_code == 413
+    assert list(upload_directory.iterdir()) == []
+
+
+def test_endpoint_upload_file_without_file():
+    response = client.post("/uploadfile", data={"comment": "no file"})
+    assert response.status_code == 400
+
+
+def test_endpoint_upload_file_too_large_while_streaming(upload_directory):
+    body = (
+        b"--boundary\r\n"
+        b'Content-Disposition: form-data; name="file"; filename="big.bin"\r\n\r\n'
+        + b"x" * 5000
+        + b"\r\n--boundary--\r\n"
+    )
+
+    def chunked_body():  # no Content-Length header, so the limit is hit while reading
+        for start in range(0, len(body), 512):
+            yield body[start : start + 512]
+
+    with patch("streaming.MAX_UPLOAD_SIZE", 1000):
+        response = client.post(
+            "/uploadfile",
+            content=chunked_body(),
+            headers={"Content-Type": "multipart/form-data; boundary=boundary"},
+        )
+    assert response.status_code == 413
+    assert list(upload_directory.iterdir()) == []
+
+
+def upload(name: str, content: bytes):
+    response = client.post("/uploadfile", files={"file": (name, content)})
+    assert response.status_code == 200
+
+
+def test_endpoint_download_file():
+    content = bytes(range(256)) * 100
+    upload("data.bin", content)
+    response = client.get("/downloadfile/data.bin")
+    assert response.status_code == 200
+    assert response.content == content
+    assert response.headers["accept-ranges"] == "bytes"
+    assert response.headers["etag"]
+
+    response = client.get("/downloadfile/missing.bin")
+    assert response.status_code == 404
+    response = client.get("/downloadfile/..%2Fmain.py")
+    assert response.status_code == 404
+
+
+def test_endpoint_download_file_range():
+    content = bytes(range(256)) * 100
+    upload("data.bin", content)
+    response = client.get("/downloadfile/data.bin", headers={"Range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.content == content[100:200]
+    assert response.headers["content-range"] == f"bytes 100-199/{len(content)}"
+
+    response = client.get("/downloadfile/data.bin", headers={"Range": "bytes=-10"})
+    assert response.status_code == 206
+    assert response.content == content[-10:]
+
+    response = client.get(
+        "/downloadfile/data.bin", headers={"Range": "bytes=0-1,10-11"}
+    )
+    assert response.status_code == 206
+    assert response.headers["content-type"].startswith("multipart/byteranges")
+
+    response = client.get(
+        "/downloadfile/data.bin", headers={"Range": f"bytes={len(content) + 10}-"}
+    )
+    assert response.status_code == 416
+
+
+def test_endpoint_download_file_if_none_match():
+    upload("data.bin", b"version one")
+    etag = client.get("/downloadfile/data.bin").headers["etag"]
+
+    response = client.get("/downloadfile/data.bin", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
+    response = client.get(
+        "/downloadfile/data.bin", headers={"If-None-Match": '"other"'}
+    )
+    assert response.status_code == 200
+
+
+import hashlib
+
+
+def upload_in_session(filename: str, chunks: list[bytes], **session_fields):
+    response = client.post(
+        "/upload-sessions", json={"filename": filename, **session_fields}
+    )
+    assert response.status_code == 200
+    session = response.json()
+    for number, chunk in enumerate(chunks):
+        response = client.put(
+            f"/upload-sessions/{session['id']}/chunks/{number}", content=chunk
+        )
+        assert response.status_code == 200
+    return session
+
+
+def test_upload_session(upload_directory):
+    chunks = [b"a" * 1000, b"b" * 1000, b"c" * 10]
+    session = upload_in_session("artifact.bin", chunks, size=2010)
+    assert session["status"] == "open"
+
+    response = client.post(f"/upload-sessions/{session['id']}/commit")
+    assert response.status_code == 200
+    committed = response.json()
+    content = b"".join(chunks)
+    assert committed["sha256"] == hashlib.sha256(content).hexdigest()
+    assert committed["deduplicated"] is False
+    assert (upload_directory / "artifact.bin").read_bytes() == content
+    assert client.get("/downloadfile/artifact.bin").content == content
+
+    response = client.get(f"/upload-sessions/{session['id']}")
+    assert response.status_code == 404
+
+
+def test_upload_session_resume(upload_directory):
+    session = upload_in_session("artifact.bin", [b"first"])
+    session_url = f"/upload-sessions/{session['id']}"
+    client.put(f"{session_url}/chunks/2", content=b"third")
+
+    response = client.post(f"{session_url}/commit")
+    assert response.status_code == 409
+
+    status = client.get(session_url).json()
+    assert status["received_chunks"] == [0, 2]
+    assert status["next_chunk"] == 1
+
+    response = client.put(
+        f"{session_url}/chunks/1",
+        content=b"second",
+        headers={"X-Chunk-SHA256": hashlib.sha256(b"wrong").hexdigest()},
+    )
+    assert response.status_code == 422
+    assert client.get(session_url).json()["next_chunk"] == 1
+
+    client.put(f"{session_url}/chunks/1", content=b"second")
+    response = client.post(f"{session_url}/commit")
+    assert response.status_code == 200
+    assert (upload_directory / "artifact.bin").read_bytes() == b"firstsecondthird"
+
+
+def prove(content: bytes, challenge: dict) -> list[str]:
+    nonce = bytes.fromhex(challenge["nonce"])
+    return [
+        hashlib.sha256(nonce + content[start : start + length]).hexdigest()
+        for start, length in challenge["ranges"]
+    ]
+
+
+def test_upload_session_deduplication(upload_directory):
+    content = b"same artifact" * 1000
+    sha256 = hashlib.sha256(content).hexdigest()
+    session = upload_in_session("first.bin", [content])
+    client.post(f"/upload-sessions/{session['id']}/commit")
+
+    # known content: completed without sending a single chunk, after proving to have it
+    response = client.post(
+        "/upload-sessions", json={"filename": "second.bin", "sha256": sha256}
+    )
+    session = response.json()
+    assert session["status"] == "open"
+    response = client.post(
+        f"/upload-sessions/{session['id']}/proof",
+        json={"hashes": prove(content, session["challenge"])},
+    )
+    assert response.json()["status"] == "completed"
+    assert response.json()["deduplicated"] is True
+
+    # unknown hash up front, but the content turns out to be known at commit
+    session = upload_in_session("third.bin", [content])
+    response = client.post(f"/upload-sessions/{session['id']}/commit")
+    assert response.json()["deduplicated"] is True
+
+    blob = upload_directory / ".blobs" / sha256[:2] / sha256
+    for name in ("first.bin", "second.bin", "third.bin"):
+        assert (upload_directory / name).read_bytes() == content
+        assert (upload_directory / name).stat().st_ino == blob.stat().st_ino
+
+
+def test_upload_session_size_limit(upload_directory):
+    with patch("streaming.MAX_UPLOAD_SIZE", 1000):
+        response = client.post(
+            "/upload-sessions", json={"filename": "big.bin", "size": 1001}
+        )
+        assert response.status_code == 413
+
+        session = upload_in_session("big.bin", [b"x" * 600])
+        session_url = f"/upload-sessions/{session['id']}"
+        response = client.put(f"{session_url}/chunks/1", content=b"x" * 600)
+        assert response.status_code == 413
+        # a retried chunk replaces the earlier attempt, it doesn't add to it
+        response = client.put(f"{session_url}/chunks/0", content=b"x" * 1000)
+        assert response.status_code == 200
+        assert client.get(session_url).json()["received_bytes"] == 1000
+
+
+def test_upload_session_hash_alone_does_not_give_the_content(upload_directory):
+    private = b"private v1" * 1000
+    sha256 = hashlib.sha256(private).hexdigest()
+    session = upload_in_session("s.bin", [private])
+    client.post(f"/upload-sessions/{session['id']}/commit")
+    client.post("/uploadfile", files={"file": ("s.bin", b"public v2")})
+
+    response = client.post(
+        "/upload-sessions", json={"filename": "grab.bin", "sha256": sha256}
+    )
+    session = response.json()
+    assert session["status"] == "open"
+    session_url = f"/upload-sessions/{session['id']}"
+    guess = [sha256] * len(session["challenge"]["ranges"])
+    response = client.post(f"{session_url}/proof", json={"hashes": guess})
+    assert response.status_code == 422
+    # one attempt only, even the right answer doesn't count any more
+    right = prove(private, session["challenge"])
+    response = client.post(f"{session_url}/proof", json={"hashes": right})
+    assert response.status_code == 409
+    assert client.post(f"{session_url}/commit").status_code == 409
+    assert client.get("/downloadfile/grab.bin").status_code == 404
+
+
+from sessions import session_locks
+
+
+def test_upload_session_lock_released_after_failed_commit(upload_directory):
+    session = upload_in_session("artifact.bin", [b"a"], size=10)
+    response = client.post(f"/upload-sessions/{session['id']}/commit")
+    assert response.status_code == 409
+    assert session["id"] not in session_locks
+
+
+import gzip
+import time
+
+
+def wait_for_job(job_id: str) -> dict:
+    for _ in range(100):
+        job = client.get(f"/jobs/{job_id}").json()
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError("job did not finish")
+
+
+def test_endpoint_upload_files(upload_directory):
+    contents = {
+        f"file{number}.txt": bytes([65 + number]) * (number + 1) * 100_000
+        for number in range(6)
+    }
+    with patch("main.MAX_PARALLEL_WRITES", 2):
+        response = client.post(
+            "/uploadfiles",
+            params={"compress": True},
+            files=[("files", (name, content)) for name, content in contents.items()],
+        )
+    assert response.status_code == 200
+    body = response.json()
+    assert body["files"] == [
+        {"filename": name, "size": len(content)} for name, content in contents.items()
+    ]
+    for name, content in contents.items():
+        assert (upload_directory / name).read_bytes() == content
+
+    job = wait_for_job(body["job_id"])
+    assert job["status"] == "done"
+    for report in job["files"]:
+        content = contents[report["filename"]]
+        assert report["sha256"] == hashlib.sha256(content).hexdigest()
+        assert report["size"] == len(content)
+        compressed = upload_directory / report["compressed_filename"]
+        assert gzip.decompress(compressed.read_bytes()) == content
+
+
+def test_endpoint_upload_files_errors():
+    response = client.post(
+        "/uploadfiles", files=[("files", ("a.txt", b"1")), ("files", ("a.txt", b"2"))]
+    )
+    assert response.status_code == 400
+    response = client.post("/uploadfiles", data={"comment": "no files"})
+    assert response.status_code == 400
+    assert client.get("/jobs/unknown").status_code == 404
+
+
+def test_endpoint_upload_files_compress_keeps_uploaded_files(upload_directory):
+    response = client.post(
+        "/uploadfiles",
+        params={"compress": True},
+        files=[("files", ("a.txt", b"plain")), ("files", ("a.txt.gz", b"mine"))],
+    )
+    job = wait_for_job(response.json()["job_id"])
+    assert (upload_directory / "a.txt.gz").read_bytes() == b"mine"
+    compressed = {
+        report["filename"]: report["compressed_filename"] for report in job["files"]
+    }
+    assert compressed["a.txt"] == f".derived/{job['id']}/a.txt.gz"
+    assert (
+        gzip.decompress((upload_directory / compressed["a.txt"]).read_bytes())
+        == b"plain"
+    )
+
+
+def test_endpoint_upload_files_truncated_body(upload_directory):
+    body = (
+        b"--boundary\r\n"
+        b'Content-Disposition: form-data; name="files"; filename="done.txt"\r\n\r\n'
+        b"complete\r\n"
+        b"--boundary\r\n"
+        b'Content-Disposition: form-data; name="files"; filename="cut.txt"\r\n\r\n'
+        + b"x" * 5000  # the closing boundary never comes
+    )
+    response = client.post(
+        "/uploadfiles",
+        content=body,
+        headers={"Content-Type": "multipart/form-data; boundary=boundary"},
+    )
+    assert response.status_code == 400
+    assert not (upload_directory / "cut.txt").exists()
+    assert not list(upload_directory.glob("*.part")) + list(upload_directory.glob(".*"))